@@ -0,0 +1,693 @@
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+logger = logging.getLogger('AccountStore')
+
+# 用户数据存储路径
+DATA_FILE = 'data/users.json'
+# 分片存储目录
+SHARD_DIR = 'data/shards'
+# 按需加载模式使用的账户数据库
+ACCOUNT_DB = 'data/accounts.db'
+
+# PIN哈希格式: pbkdf2_sha256$<迭代次数>$<盐>$<哈希>
+PIN_HASH_SCHEME = 'pbkdf2_sha256'
+PIN_HASH_ITERATIONS = 20000
+
+DEFAULT_USERS = {
+    "123456": {"password": "1234", "balance": 10000.0},
+    "654321": {"password": "4321", "balance": 5000.0}
+}
+
+
+def shard_of(user_id, shard_count):
+    """根据卡号计算分片编号（使用crc32，保证不同进程、不同机器结果一致）"""
+    return zlib.crc32(user_id.encode('utf-8')) % shard_count
+
+
+def hash_pin(pin, iterations=PIN_HASH_ITERATIONS):
+    """计算PIN的加盐哈希，返回可直接存入账户的字符串"""
+    salt = os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt.encode('ascii'), iterations)
+    return f"{PIN_HASH_SCHEME}${iterations}${salt}${digest.hex()}"
+
+
+def check_pin(stored, pin):
+    """校验PIN，兼容未哈希的旧账户数据"""
+    if not stored.startswith(PIN_HASH_SCHEME + '$'):
+        return hmac.compare_digest(stored.encode('utf-8'), pin.encode('utf-8'))
+    _, iterations, salt, expected = stored.split('$')
+    digest = hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt.encode('ascii'), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def open_store(shards=0, lazy=False, cache_size=10000, seed=True):
+    """
+    根据配置创建账户存储：按需加载（SQLite）、分片或单文件
+
+    seed 为False时，新建的存储不导入 data/users.json 或默认演示账户（往空数据目录导入账户时使用）。
+    """
+    seed_file = DATA_FILE if seed else None
+    if lazy:
+        return LazyAccountStore(SqliteAccountStore(seed_file=seed_file), cache_size)
+    if shards > 0:
+        return ShardedAccountStore(shard_count=shards, seed_file=seed_file)
+    return JsonAccountStore(seed=seed)
+
+
+def _import_in_chunks(store, records, chunk_size):
+    """分块调用 put_users，每块写入一次，内存占用与记录总数无关"""
+    records = iter(records)
+    count = 0
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return count
+        store.put_users(chunk)
+        count += len(chunk)
+
+
+class Journal:
+    """
+    快照 + 追加日志的持久化文件对
+
+    每次修改只向日志追加一行JSON；日志累积到一定条数后把完整状态写成快照并清空日志。
+    启动恢复时先读快照，再按顺序重放日志。
+    """
+
+    def __init__(self, snapshot_path, journal_path):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.entries = 0
+        self.corrupt = False
+        self._file = None
+
+    def read_snapshot(self, default=None):
+        """读取快照，不存在时返回默认值"""
+        if not os.path.exists(self.snapshot_path):
+            return default
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def replay(self):
+        """逐条读取日志记录，忽略崩溃时写了一半的最后一行"""
+        self.entries = 0
+        self.corrupt = False
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"忽略损坏的日志记录: {self.journal_path}")
+                    self.corrupt = True
+                    break
+                self.entries += 1
+                yield entry
+
+    def append(self, entry):
+        """追加一条日志记录；写入失败时截掉写了一半的内容并抛出 OSError"""
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        size = os.fstat(self._file.fileno()).st_size
+        try:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()
+        except OSError:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            # 写了一半的行会让之后追加的记录在恢复时被跳过
+            os.truncate(self.journal_path, size)
+            raise
+        self.entries += 1
+
+    def compact(self, state):
+        """把完整状态写成快照并清空日志"""
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.snapshot_path)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._file = open(self.journal_path, 'w', encoding='utf-8')
+        self.entries = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class JsonAccountStore:
+    """单文件账户存储，所有账户保存在 data/users.json 中"""
+
+    def __init__(self, path=DATA_FILE, seed=True):
+        self.path = path
+        # 文件不存在时是否创建默认演示账户
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.users = self.load_users()
+
+    def load_users(self):
+        """从文件加载用户数据"""
+        if not os.path.exists(self.path):
+            if not self.seed:
+                return {}
+            default_users = {user_id: dict(record) for user_id, record in DEFAULT_USERS.items()}
+            with open(self.path, 'w') as f:
+                json.dump(default_users, f, indent=2)
+            logger.info(f"创建默认用户数据文件: {self.path}")
+            return default_users
+
+        try:
+            with open(self.path, 'r') as f:
+                users = json.load(f)
+            logger.info(f"从 {self.path} 加载了 {len(users)} 个用户")
+            return users
+        except Exception as e:
+            logger.error(f"加载用户数据错误: {str(e)}")
+            return {}
+
+    def save_users(self):
+        """保存用户数据到文件"""
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.users, f, indent=2)
+            logger.info(f"保存了 {len(self.users)} 个用户数据到 {self.path}")
+        except Exception as e:
+            logger.error(f"保存用户数据错误: {str(e)}")
+
+    def get_user(self, user_id):
+        """查询账户，不存在时返回None"""
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+    def withdraw(self, user_id, amount):
+        """扣款，成功返回新余额，账户不存在或余额不足返回None"""
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None or user["balance"] < amount:
+                return None
+            user["balance"] -= amount
+            self.save_users()
+            return user["balance"]
+
+    def deposit(self, user_id, amount):
+        """存入（用于冲正），成功返回新余额，账户不存在返回None"""
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return None
+            user["balance"] += amount
+            self.save_users()
+            return user["balance"]
+
+    def put_users(self, records):
+        """批量新增或覆盖账户，records 为 (卡号, 密码, 余额) 序列"""
+        with self.lock:
+            for user_id, password, balance in records:
+                self.users[user_id] = {"password": password, "balance": balance}
+            self.save_users()
+
+    def import_users(self, records):
+        """
+        批量导入账户，records 为 (卡号, 密码, 余额) 的可迭代对象
+
+        全部记录合并到内存后只写一次文件（先写临时文件再替换），导入中途失败时原文件不变。
+        """
+        count = 0
+        with self.lock:
+            for user_id, password, balance in records:
+                self.users[user_id] = {"password": password, "balance": balance}
+                count += 1
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.users, f, indent=2)
+            os.replace(tmp_path, self.path)
+        logger.info(f"导入了 {count} 个用户到 {self.path}，共 {len(self.users)} 个用户")
+        return count
+
+    def iter_users(self):
+        """逐个遍历账户 (卡号, 账户)"""
+        for user_id in list(self.users):
+            user = self.get_user(user_id)
+            if user:
+                yield user_id, user
+
+    def iter_balances(self):
+        """遍历 (卡号, 余额)，用于发布余额快照"""
+        for user_id, user in list(self.users.items()):
+            yield user_id, user["balance"]
+
+    def __len__(self):
+        return len(self.users)
+
+    def close(self):
+        pass
+
+
+class AccountShard:
+    """单个账户分片：独立的锁、日志文件和快照"""
+
+    def __init__(self, index, directory, compact_every=1000):
+        self.index = index
+        self.lock = threading.Lock()
+        self.users = {}
+        self.compact_every = compact_every
+        self.journal = Journal(
+            os.path.join(directory, f"shard-{index:03d}.json"),
+            os.path.join(directory, f"shard-{index:03d}.journal")
+        )
+
+    def load(self):
+        """读取快照并重放日志"""
+        with self.lock:
+            self.users = self.journal.read_snapshot({})
+            for entry in self.journal.replay():
+                self._apply(entry)
+            if self.journal.corrupt:
+                # 截掉损坏的尾部，避免之后追加的记录在下次恢复时被跳过
+                self.journal.compact(self.users)
+            return len(self.users)
+
+    def _apply(self, entry):
+        op = entry["op"]
+        if op == "put":
+            self.users[entry["id"]] = {"password": entry["password"], "balance": entry["balance"]}
+        elif op == "bal":
+            self.users[entry["id"]]["balance"] = entry["balance"]
+
+    def _log(self, entry):
+        """
+        写入日志后再应用修改，日志过长时压缩为快照（调用方持有锁）
+
+        写日志失败时抛出 OSError，内存中的数据不变；压缩失败不影响已经写入日志的修改，下次再压缩。
+        """
+        self.journal.append(entry)
+        self._apply(entry)
+        if self.journal.entries >= self.compact_every:
+            try:
+                self.journal.compact(self.users)
+                logger.info(f"分片 {self.index} 已压缩为快照，共 {len(self.users)} 个用户")
+            except OSError as e:
+                logger.error(f"分片 {self.index} 压缩快照失败: {str(e)}")
+
+    def get_user(self, user_id):
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+    def put_user(self, user_id, password, balance):
+        with self.lock:
+            self._log({"op": "put", "id": user_id, "password": password, "balance": balance})
+
+    def put_users(self, records):
+        with self.lock:
+            for user_id, password, balance in records:
+                self._log({"op": "put", "id": user_id, "password": password, "balance": balance})
+
+    def withdraw(self, user_id, amount):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None or user["balance"] < amount:
+                return None
+            self._log({"op": "bal", "id": user_id, "balance": user["balance"] - amount})
+            return self.users[user_id]["balance"]
+
+    def deposit(self, user_id, amount):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return None
+            self._log({"op": "bal", "id": user_id, "balance": user["balance"] + amount})
+            return self.users[user_id]["balance"]
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
+
+
+class ShardedAccountStore:
+    """
+    按卡号哈希分片的账户存储
+
+    每个分片有自己的锁、日志和快照，不同分片上的写操作互不阻塞；
+    重启时各分片并行恢复。首次创建时从 data/users.json 导入已有账户。
+    """
+
+    def __init__(self, directory=SHARD_DIR, shard_count=8, compact_every=1000, seed_file=DATA_FILE):
+        self.directory = directory
+        self.shard_count = shard_count
+        os.makedirs(directory, exist_ok=True)
+
+        fresh = self._check_meta()
+        self.shards = [AccountShard(i, directory, compact_every) for i in range(shard_count)]
+        self.load()
+
+        if fresh:
+            if seed_file is not None:
+                self._seed(seed_file)
+            # 导入完成后才写入元数据，导入中途崩溃时下次启动会重新导入
+            with open(os.path.join(self.directory, 'shards.json'), 'w') as f:
+                json.dump({"shard_count": self.shard_count}, f)
+
+    def _check_meta(self):
+        """校验分片数量与目录中已有数据一致，返回是否为新建目录（没有元数据文件）"""
+        meta_path = os.path.join(self.directory, 'shards.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta["shard_count"] != self.shard_count:
+                raise ValueError(
+                    f"{self.directory} 中的数据使用 {meta['shard_count']} 个分片，"
+                    f"与配置的 {self.shard_count} 个不一致"
+                )
+            return False
+        return True
+
+    def _seed(self, seed_file):
+        """新建分片目录时导入单文件存储中的账户"""
+        users = DEFAULT_USERS
+        if os.path.exists(seed_file):
+            with open(seed_file, 'r') as f:
+                users = json.load(f)
+        self.import_users(
+            (user_id, record["password"], record["balance"]) for user_id, record in users.items()
+        )
+        logger.info(f"从 {seed_file} 导入了 {len(users)} 个用户到 {self.shard_count} 个分片")
+
+    def load(self):
+        """并行恢复所有分片"""
+        with ThreadPoolExecutor(max_workers=min(self.shard_count, 8)) as pool:
+            counts = list(pool.map(lambda shard: shard.load(), self.shards))
+        logger.info(f"从 {self.directory} 的 {self.shard_count} 个分片加载了 {sum(counts)} 个用户")
+
+    def shard_for(self, user_id):
+        return self.shards[shard_of(user_id, self.shard_count)]
+
+    def get_user(self, user_id):
+        """查询账户，不存在时返回None"""
+        return self.shard_for(user_id).get_user(user_id)
+
+    def put_user(self, user_id, password, balance):
+        """新增或覆盖账户"""
+        self.shard_for(user_id).put_user(user_id, password, balance)
+
+    def put_users(self, records):
+        """批量新增或覆盖账户，按分片分组后各自加锁写入"""
+        groups = {}
+        for record in records:
+            groups.setdefault(shard_of(record[0], self.shard_count), []).append(record)
+        for index, group in groups.items():
+            self.shards[index].put_users(group)
+
+    def import_users(self, records):
+        """
+        批量导入账户，records 为 (卡号, 密码, 余额) 的可迭代对象
+
+        记录直接放入各分片的内存数据、不写日志，全部读完后每个分片写一次快照并清空日志；
+        导入中途失败时磁盘上的数据不变。
+        """
+        count = 0
+        for user_id, password, balance in records:
+            shard = self.shard_for(user_id)
+            with shard.lock:
+                shard.users[user_id] = {"password": password, "balance": balance}
+            count += 1
+        for shard in self.shards:
+            with shard.lock:
+                shard.journal.compact(shard.users)
+        logger.info(f"导入了 {count} 个用户到 {self.shard_count} 个分片，共 {len(self)} 个用户")
+        return count
+
+    def iter_users(self):
+        """逐个分片遍历账户 (卡号, 账户)"""
+        for shard in self.shards:
+            for user_id in list(shard.users):
+                user = shard.get_user(user_id)
+                if user:
+                    yield user_id, user
+
+    def withdraw(self, user_id, amount):
+        """扣款，成功返回新余额，账户不存在或余额不足返回None"""
+        return self.shard_for(user_id).withdraw(user_id, amount)
+
+    def deposit(self, user_id, amount):
+        """存入（用于冲正），成功返回新余额，账户不存在返回None"""
+        return self.shard_for(user_id).deposit(user_id, amount)
+
+    def iter_balances(self):
+        """遍历 (卡号, 余额)，用于发布余额快照"""
+        for shard in self.shards:
+            for user_id, user in list(shard.users.items()):
+                yield user_id, user["balance"]
+
+    def __len__(self):
+        return sum(len(shard.users) for shard in self.shards)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+class SqliteAccountStore:
+    """
+    SQLite 账户存储，按卡号主键单条读写
+
+    不需要在启动时把全部账户读入内存，适合作为按需加载模式的后备存储。
+    首次创建时从 data/users.json 导入已有账户。
+    """
+
+    def __init__(self, path=ACCOUNT_DB, seed_file=DATA_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS accounts ("
+            "card TEXT PRIMARY KEY, password TEXT NOT NULL, balance REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+        if seed_file is not None and self.conn.execute("SELECT 1 FROM accounts LIMIT 1").fetchone() is None:
+            self._seed(seed_file)
+
+    def _seed(self, seed_file):
+        """新建数据库时导入单文件存储中的账户"""
+        users = DEFAULT_USERS
+        if os.path.exists(seed_file):
+            with open(seed_file, 'r') as f:
+                users = json.load(f)
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)",
+                ((user_id, record["password"], record["balance"]) for user_id, record in users.items())
+            )
+            self.conn.commit()
+        logger.info(f"从 {seed_file} 导入了 {len(users)} 个用户到 {self.path}")
+
+    def get_user(self, user_id):
+        """查询账户，不存在时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT password, balance FROM accounts WHERE card = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"password": row[0], "balance": row[1]}
+
+    def put_user(self, user_id, password, balance):
+        """新增或覆盖账户"""
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)", (user_id, password, balance))
+            self.conn.commit()
+
+    def put_users(self, records):
+        """批量新增或覆盖账户，整批在一个事务中提交"""
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)", records)
+            self.conn.commit()
+
+    def import_users(self, records, chunk_size=1000):
+        """批量导入账户，分块写入、每块一个事务，内存占用与账户总数无关"""
+        return _import_in_chunks(self, records, chunk_size)
+
+    def iter_users(self, chunk_size=1000):
+        """使用独立的只读连接分块遍历账户，不阻塞正常读写"""
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute("SELECT card, password, balance FROM accounts ORDER BY card")
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for card, password, balance in rows:
+                    yield card, {"password": password, "balance": balance}
+        finally:
+            conn.close()
+
+    def iter_balances(self):
+        """遍历 (卡号, 余额)，用于发布余额快照"""
+        for card, user in self.iter_users():
+            yield card, user["balance"]
+
+    def withdraw(self, user_id, amount):
+        """扣款，成功返回新余额，账户不存在或余额不足返回None"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE accounts SET balance = balance - ? WHERE card = ? AND balance >= ?",
+                (amount, user_id, amount)
+            )
+            if cursor.rowcount == 0:
+                return None
+            balance = self.conn.execute("SELECT balance FROM accounts WHERE card = ?", (user_id,)).fetchone()[0]
+            self.conn.commit()
+            return balance
+
+    def deposit(self, user_id, amount):
+        """存入（用于冲正），成功返回新余额，账户不存在返回None"""
+        with self.lock:
+            cursor = self.conn.execute("UPDATE accounts SET balance = balance + ? WHERE card = ?", (amount, user_id))
+            if cursor.rowcount == 0:
+                return None
+            balance = self.conn.execute("SELECT balance FROM accounts WHERE card = ?", (user_id,)).fetchone()[0]
+            self.conn.commit()
+            return balance
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class LazyAccountStore:
+    """
+    按需加载的账户存储
+
+    账户在第一次被访问（HELO）时才从后备存储读取，并保存在容量有限的LRU缓存中；
+    取款先写入后备存储再更新缓存（write-through），缓存中的数据始终与后备存储一致。
+
+    self.lock 只保护缓存本身，不在持有它时读写后备存储，缓存命中不会被磁盘I/O阻塞。
+    同一张卡的缓存填充和写入由按卡号哈希选取的锁串行化，读取后备存储期间发生的取款
+    不会被随后放入缓存的旧数据覆盖。
+    """
+
+    def __init__(self, backing, capacity=10000, stripes=64):
+        self.backing = backing
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.card_locks = [threading.Lock() for _ in range(stripes)]
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, user_id, user):
+        """放入缓存并淘汰最久未使用的账户（调用方持有锁）"""
+        self.cache[user_id] = user
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def _card_lock(self, user_id):
+        return self.card_locks[shard_of(user_id, len(self.card_locks))]
+
+    def _cached(self, user_id):
+        """从缓存读取，未命中时返回None"""
+        with self.lock:
+            user = self.cache.get(user_id)
+            if user is None:
+                return None
+            self.cache.move_to_end(user_id)
+            self.hits += 1
+            return dict(user)
+
+    def get_user(self, user_id):
+        """查询账户，不存在时返回None"""
+        user = self._cached(user_id)
+        if user is not None:
+            return user
+
+        with self._card_lock(user_id):
+            # 等锁期间可能已经有其他线程放入了缓存
+            user = self._cached(user_id)
+            if user is not None:
+                return user
+            user = self.backing.get_user(user_id)
+            with self.lock:
+                self.misses += 1
+                if user is not None:
+                    self._remember(user_id, user)
+        return dict(user) if user is not None else None
+
+    def put_user(self, user_id, password, balance):
+        """新增或覆盖账户"""
+        with self._card_lock(user_id):
+            self.backing.put_user(user_id, password, balance)
+            with self.lock:
+                self._remember(user_id, {"password": password, "balance": balance})
+
+    def put_users(self, records):
+        """批量写入后备存储，并丢弃缓存中被覆盖的账户；期间暂停所有卡的缓存填充和写入"""
+        records = list(records)
+        with ExitStack() as stack:
+            for lock in self.card_locks:
+                stack.enter_context(lock)
+            self.backing.put_users(records)
+            with self.lock:
+                for record in records:
+                    self.cache.pop(record[0], None)
+
+    def import_users(self, records, chunk_size=1000):
+        """批量导入账户，分块写入后备存储，内存占用与账户总数无关"""
+        return _import_in_chunks(self, records, chunk_size)
+
+    def iter_users(self):
+        return self.backing.iter_users()
+
+    def iter_balances(self):
+        """只遍历缓存中的热点账户，快照中没有的账户由调用方回退到主存储查询"""
+        with self.lock:
+            items = [(user_id, user["balance"]) for user_id, user in self.cache.items()]
+        return iter(items)
+
+    def withdraw(self, user_id, amount):
+        """扣款，成功返回新余额，账户不存在或余额不足返回None"""
+        return self._update_balance(user_id, self.backing.withdraw, amount)
+
+    def deposit(self, user_id, amount):
+        """存入（用于冲正），成功返回新余额，账户不存在返回None"""
+        return self._update_balance(user_id, self.backing.deposit, amount)
+
+    def _update_balance(self, user_id, update, amount):
+        """写入后备存储，成功后更新缓存中的余额（write-through）"""
+        with self._card_lock(user_id):
+            balance = update(user_id, amount)
+            if balance is not None:
+                with self.lock:
+                    if user_id in self.cache:
+                        self.cache[user_id]["balance"] = balance
+                        self.cache.move_to_end(user_id)
+            return balance
+
+    def __len__(self):
+        return len(self.backing)
+
+    def close(self):
+        self.backing.close()
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import itertools
+import json
+import logging
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .account_store import open_store, hash_pin, PIN_HASH_SCHEME, PIN_HASH_ITERATIONS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('AccountTool')
+
+CSV_FIELDS = ["card", "password", "balance"]
+
+
+def detect_format(path, fmt):
+    """未指定格式时根据扩展名判断"""
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(f, fmt):
+    """逐行读取账户记录（字典），不把整个文件读入内存"""
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def validate(record):
+    """
+    校验一条记录，返回 (卡号, 明文PIN, 已哈希的密码, 余额)，无效时抛出 ValueError
+
+    记录中可以给出明文 "pin"（导入时哈希），也可以给出导出文件中已哈希的 "password"；
+    旧版本导出的未哈希的 "password" 按明文PIN处理。
+    """
+    card = str(record.get("card", "")).strip()
+    if not card.isdigit() or not 6 <= len(card) <= 19:
+        raise ValueError(f"无效的卡号: {card!r}")
+
+    pin = record.get("pin")
+    password = record.get("password")
+    if pin in (None, "") and password and not str(password).startswith(PIN_HASH_SCHEME + '$'):
+        pin, password = password, None
+    if pin not in (None, ""):
+        pin = str(pin).strip()
+        if not pin.isdigit() or not 4 <= len(pin) <= 6:
+            raise ValueError(f"卡号 {card} 的PIN必须是4到6位数字")
+    elif not password or not str(password).startswith(PIN_HASH_SCHEME + '$'):
+        raise ValueError(f"卡号 {card} 缺少PIN")
+
+    balance = float(record.get("balance", 0))
+    if not math.isfinite(balance) or balance < 0:
+        raise ValueError(f"卡号 {card} 的余额必须是非负的有限数值")
+
+    return card, pin, password, balance
+
+
+def import_accounts(store, path, fmt, chunk_size, workers, iterations):
+    """
+    分块导入账户：读取、校验、并行哈希PIN，交给存储的 import_users 写入
+
+    SQLite 存储（--lazy）逐块写入，内存占用与账户数无关；单文件和分片存储本身把全部账户保存在内存中，
+    导入时同样如此，全部读完后只写一次文件或快照。
+    """
+    imported = rejected = 0
+    started = time.perf_counter()
+
+    def prepare(item):
+        card, pin, password, balance = item
+        return card, hash_pin(pin, iterations) if pin else password, balance
+
+    def prepared_records(f, pool):
+        nonlocal imported, rejected
+        numbered = enumerate(read_records(f, fmt), start=1)
+        while True:
+            chunk = list(itertools.islice(numbered, chunk_size))
+            if not chunk:
+                return
+
+            valid = []
+            for number, record in chunk:
+                try:
+                    valid.append(validate(record))
+                except (ValueError, TypeError, AttributeError) as e:
+                    rejected += 1
+                    logger.warning(f"第 {number} 条记录被跳过: {e}")
+
+            # hashlib.pbkdf2_hmac 计算时会释放GIL，线程池即可并行
+            yield from pool.map(prepare, valid)
+            imported += len(valid)
+            logger.info(f"已处理 {imported} 个账户")
+
+    with open(path, 'r', encoding='utf-8', newline='') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        store.import_users(prepared_records(f, pool))
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"导入完成: 成功 {imported} 个，跳过 {rejected} 个，用时 {elapsed:.2f} 秒")
+    return imported, rejected
+
+
+def export_accounts(store, path, fmt, iterations=PIN_HASH_ITERATIONS):
+    """流式导出账户，PIN以哈希形式导出（旧账户的明文PIN在导出时哈希），可直接重新导入"""
+    exported = 0
+    out = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+    try:
+        writer = csv.writer(out) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(CSV_FIELDS)
+        for card, user in store.iter_users():
+            password = user["password"]
+            if not password.startswith(PIN_HASH_SCHEME + '$'):
+                password = hash_pin(password, iterations)
+            if writer:
+                writer.writerow([card, password, user["balance"]])
+            else:
+                out.write(json.dumps({"card": card, "password": password, "balance": user["balance"]}) + '\n')
+            exported += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f"导出了 {exported} 个账户")
+    return exported
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="账户批量导入/导出工具（CSV 或 JSON Lines）")
+    parser.add_argument('action', choices=['import', 'export'], help="导入或导出")
+    parser.add_argument('file', help="账户文件路径，导出时可用 - 表示标准输出")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="文件格式，默认根据扩展名判断")
+    parser.add_argument('--shards', type=int, default=0, help="使用分片存储（与服务器的 --shards 一致）")
+    parser.add_argument('--lazy', action='store_true', help="使用按需加载模式的 SQLite 存储（与服务器的 --lazy 一致）")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="每批处理的记录数")
+    parser.add_argument('--workers', type=int, default=4, help="并行哈希PIN的线程数")
+    parser.add_argument('--iterations', type=int, default=PIN_HASH_ITERATIONS, help="PIN哈希迭代次数")
+    parser.add_argument('--no-seed', action='store_true',
+                        help="新建存储时不导入 data/users.json 和默认演示账户（往空数据目录导入时使用）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fmt = detect_format(args.file, args.format)
+    store = open_store(args.shards, args.lazy, seed=not args.no_seed)
+    try:
+        if args.action == 'import':
+            import_accounts(store, args.file, fmt, args.chunk_size, args.workers, args.iterations)
+        else:
+            export_accounts(store, args.file, fmt, args.iterations)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,21 @@
+import math
 import socket
 import logging
+import time
+
+from .history import parse_page
+from .protocol import LineReader
+from .tls import TLSSessionCache
+
+# 本地缓存余额的最长有效时间（秒），超过后重新向服务器查询
+BALANCE_MAX_AGE = 30.0
+
+
+def _tcp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # 请求/响应都是小报文，关闭Nagle算法避免与延迟确认叠加出几十毫秒的等待（TLS握手时尤其明显）
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
 
 
 class ATMClient:
@@ -7,10 +23,24 @@ class ATMClient:
     ATM客户端通信模块，负责与服务器的网络通信和业务逻辑处理
     """
 
-    def __init__(self, host='localhost', port=2525):
+    def __init__(self, host='localhost', port=2525, cash=None, balance_max_age=BALANCE_MAX_AGE,
+                 socket_factory=None, tls_context=None, tls_sessions=None, terminal=None):
         self.host = host
         self.port = port
+        # 创建连接用的socket（仿真时替换为内存中的socket）
+        self.socket_factory = socket_factory if socket_factory is not None else _tcp_socket
+        # TLS（tls_context 为None时明文通信）；会话缓存可在多个客户端之间共享，用于恢复会话
+        self.tls_context = tls_context
+        self.tls_sessions = tls_sessions if tls_sessions is not None else TLSSessionCache()
+        # 终端钞箱库存（CashInventory），为None时不做配钞检查
+        self.cash = cash
+        # 终端编号（未指定时使用钞箱状态文件中的编号），随 HELO 发送，服务器据此记录交易发生的终端
+        self.terminal = terminal if terminal is not None else (cash.terminal if cash else None)
+        # 会话内的余额缓存: (余额, 最近一次从服务器读取的时间)
+        self.balance_max_age = balance_max_age
+        self.balance_cache = None
         self.socket = None
+        self.reader = None
         self.user_id = None
         self.logger = self._setup_logger()
         self.callbacks = {
@@ -20,15 +50,19 @@ class ATMClient:
             "on_pin_verified": None,
             "on_balance_result": None,
             "on_withdraw_success": None,
+            "on_history_result": None,
             "on_exit": None
         }
 
     def _setup_logger(self):
         """配置日志记录器"""
         logger = logging.getLogger('ATMClient')
-        logger.setLevel(logging.INFO)
 
         if not logger.handlers:
+            # 调用方（如命令行终端）事先设置过日志级别时保留其设置
+            if logger.level == logging.NOTSET:
+                logger.setLevel(logging.INFO)
+
             handler = logging.StreamHandler()
             formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
             handler.setFormatter(formatter)
@@ -44,9 +78,22 @@ class ATMClient:
     def connect(self):
         """连接到服务器"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
-            self.logger.info(f"已连接到服务器: {self.host}:{self.port}")
+            sock = self.socket_factory()
+            sock.connect((self.host, self.port))
+            transport = "明文"
+            if self.tls_context is not None:
+                try:
+                    sock = self.tls_context.wrap_socket(
+                        sock, server_hostname=self.host, session=self.tls_sessions.get()
+                    )
+                except Exception:
+                    sock.close()
+                    raise
+                self.tls_sessions.connected(sock)
+                transport = f"{sock.version()}，{'恢复会话' if sock.session_reused else '完整握手'}"
+            self.socket = sock
+            self.reader = LineReader(self.socket)
+            self.logger.info(f"已连接到服务器: {self.host}:{self.port}（{transport}）")
             return True
         except Exception as e:
             self.logger.error(f"无法连接到服务器: {str(e)}")
@@ -54,14 +101,19 @@ class ATMClient:
 
     def disconnect(self):
         """断开与服务器的连接"""
+        self.invalidate_balance()
         if self.socket:
             try:
+                if self.tls_context is not None:
+                    # 会话票据在握手之后到达，断开前保存供下次连接恢复
+                    self.tls_sessions.put(self.socket)
                 self.socket.close()
                 self.logger.info("已断开与服务器的连接")
             except Exception as e:
                 self.logger.error(f"断开连接时出错: {str(e)}")
             finally:
                 self.socket = None
+                self.reader = None
 
     def send_receive(self, message):
         """发送消息并接收响应"""
@@ -72,16 +124,39 @@ class ATMClient:
         try:
             self.logger.info(f"发送消息: {message}")
             self.socket.sendall((message + '\n').encode('utf-8'))
-            response = self.socket.recv(1024).decode('utf-8')
+            response = self.reader.readline()
+            if response is None:
+                raise ConnectionError("服务器已关闭连接")
             self.logger.info(f"接收响应: {response}")
             return response
         except Exception as e:
             self.logger.error(f"通信错误: {str(e)}")
             return None
 
+    def cached_balance(self):
+        """
+        返回仍在有效期内的缓存余额，没有时返回None
+
+        缓存由 BALA 的结果建立，取款成功后在本地扣减；本地扣减不刷新读取时间，
+        所以距离上一次从服务器读取超过 balance_max_age 后一定会重新查询。
+        """
+        if self.balance_cache is None:
+            return None
+        balance, fetched_at = self.balance_cache
+        if time.monotonic() - fetched_at > self.balance_max_age:
+            self.balance_cache = None
+            return None
+        return balance
+
+    def invalidate_balance(self):
+        """丢弃缓存余额，下次查询时向服务器重新读取"""
+        self.balance_cache = None
+
     def insert_card(self, user_id):
         """发送卡号登录请求"""
         self.user_id = user_id
+        if self.terminal:
+            return self.send_receive(f"HELO {user_id} {self.terminal}")
         return self.send_receive(f"HELO {user_id}")
 
     def verify_pin(self, pin):
@@ -95,6 +170,11 @@ class ATMClient:
     def withdraw(self, amount):
         """发送取款请求"""
         return self.send_receive(f"WDRA {amount}")
+
+    def history(self, cursor=None):
+        """发送交易记录查询请求，cursor 为上一页返回的游标"""
+        return self.send_receive("HIST" if cursor is None else f"HIST {cursor}")
+
     def exit(self):
         """发送退出请求"""
         response = self.send_receive("BYE")
@@ -122,6 +202,7 @@ class ATMClient:
             self._trigger_callback("on_error", "连接错误", "无法连接到服务器")
             return False
             
+        self.invalidate_balance()
         response = self.insert_card(card_number)
         
         if not response:
@@ -157,19 +238,32 @@ class ATMClient:
             self._trigger_callback("on_error", "PIN错误", "PIN码不正确")
             return False
             
-    def process_balance_check(self):
-        """处理余额查询的业务逻辑"""
+    def process_balance_check(self, refresh=False):
+        """处理余额查询的业务逻辑，缓存有效且不要求刷新时直接使用缓存"""
+        balance = None if refresh else self.cached_balance()
+        if balance is not None:
+            self._trigger_callback("on_balance_result", f"{balance:.2f}")
+            return True
+
         response = self.check_balance()
         
         if not response:
+            self.invalidate_balance()
             self._trigger_callback("on_error", "通信错误", "与服务器通信失败")
             return False
             
         if response.startswith("AMNT:"):
-            balance = response.split(":", 1)[1]
-            self._trigger_callback("on_balance_result", balance)
+            try:
+                balance = float(response.split(":", 1)[1])
+            except ValueError:
+                self.invalidate_balance()
+                self._trigger_callback("on_error", "查询失败", "无法获取余额信息")
+                return False
+            self.balance_cache = (balance, time.monotonic())
+            self._trigger_callback("on_balance_result", f"{balance:.2f}")
             return True
         else:
+            self.invalidate_balance()
             self._trigger_callback("on_error", "查询失败", "无法获取余额信息")
             return False
             
@@ -181,21 +275,41 @@ class ATMClient:
             
         try:
             amount = float(amount_text)
+            if not math.isfinite(amount):
+                self._trigger_callback("on_error", "输入错误", "请输入有效的金额数值")
+                return False
             if amount <= 0:
                 self._trigger_callback("on_error", "金额错误", "请输入大于0的金额")
                 return False
-                
+
+            notes = None
+            if self.cash:
+                # 本机配不出的金额直接拒绝，不再发往服务器
+                notes = self.cash.plan(amount)
+                if notes is None:
+                    self._trigger_callback("on_error", "金额错误", f"本机无法配出该金额，{self.cash.describe_limits()}")
+                    return False
+
             response = self.withdraw(amount)
             
             if not response:
+                # 取款是否已在服务器生效未知，缓存不再可信
+                self.invalidate_balance()
                 self._trigger_callback("on_error", "通信错误", "与服务器通信失败")
                 return False
                 
             if response.startswith("525"):
                 # 允许所有525 OK开头的响应
+                if notes:
+                    self.cash.dispense(notes)
+                if self.balance_cache is not None:
+                    balance, fetched_at = self.balance_cache
+                    self.balance_cache = (balance - amount, fetched_at)
                 self._trigger_callback("on_withdraw_success", amount)
                 return True
             else:
+                # 余额不足说明缓存与服务器不一致（例如其他终端取过款）
+                self.invalidate_balance()
                 self._trigger_callback("on_error", "取款失败", "余额不足或其他错误")
                 return False
                 
@@ -203,6 +317,23 @@ class ATMClient:
             self._trigger_callback("on_error", "输入错误", "请输入有效的金额数值")
             return False
             
+    def process_history(self, cursor=None):
+        """处理交易记录查询的业务逻辑"""
+        response = self.history(cursor)
+
+        if not response:
+            self._trigger_callback("on_error", "通信错误", "与服务器通信失败")
+            return False
+
+        try:
+            records, next_cursor = parse_page(response)
+        except ValueError:
+            self._trigger_callback("on_error", "查询失败", "无法获取交易记录")
+            return False
+
+        self._trigger_callback("on_history_result", records, next_cursor)
+        return True
+
     def process_exit(self):
         """处理退出的业务逻辑"""
         response = self.exit()
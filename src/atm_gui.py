@@ -1,11 +1,109 @@
+import datetime
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QPushButton,
                              QLabel, QLineEdit, QVBoxLayout, QHBoxLayout,
                              QStackedWidget, QMessageBox, QFrame, QGridLayout,
-                             QSizePolicy)
-from PyQt5.QtCore import Qt, pyqtSignal, QObject, QSize
+                             QSizePolicy, QListWidget)
+from PyQt5.QtCore import Qt, pyqtSignal, QObject, QSize, QTimer
 from PyQt5.QtGui import QFont, QIcon, QPalette, QColor
 from .atm_client import ATMClient
 
+# 页面名称
+PAGE_WELCOME = "welcome"
+PAGE_PIN = "pin"
+PAGE_MENU = "menu"
+PAGE_BALANCE = "balance"
+PAGE_WITHDRAW = "withdraw"
+PAGE_HISTORY = "history"
+
+# 首屏显示后等待多久开始在空闲时预建其余页面（毫秒）
+IDLE_BUILD_DELAY_MS = 300
+
+# 全局样式表在模块加载时拼好，整个窗口只设置一次；
+# 各页面重复使用的标题、按钮样式通过 objectName 选择器复用，避免每个控件各自解析一份样式表
+MAIN_STYLESHEET = """
+    QMainWindow {
+        background-color: #f5f7fa;
+    }
+    QFrame#card {
+        background-color: white;
+        border-radius: 12px;
+        border: none;
+        /* box-shadow: 0 4px 12px rgba(0, 0, 0, 0.08); */
+    }
+    QLabel {
+        color: #2d3748;
+        font-size: 16px;
+    }
+    QLabel#pageTitle {
+        font-size: 28px;
+        font-weight: bold;
+        margin-bottom: 20px;
+    }
+    QLineEdit {
+        padding: 12px;
+        border: 1px solid #e2e8f0;
+        border-radius: 8px;
+        background-color: white;
+        font-size: 16px;
+        selection-background-color: #4299e1;
+        selection-color: white;
+    }
+    QLineEdit:focus {
+        border: 1px solid #4299e1;
+    }
+    QPushButton {
+        border: none;
+        border-radius: 8px;
+        padding: 12px 24px;
+        font-size: 16px;
+        font-weight: 500;
+        min-width: 120px;
+    }
+    QPushButton:hover {
+        opacity: 0.9;
+    }
+    QPushButton:pressed {
+        opacity: 0.8;
+    }
+    QPushButton#primaryButton {
+        background-color: #4299e1;
+        color: white;
+        font-weight: 600;
+    }
+    QPushButton#secondaryButton {
+        background-color: #a0aec0;
+        color: white;
+        font-weight: 600;
+    }
+    QPushButton#menuButton {
+        background-color: #edf2f7;
+        border-radius: 12px;
+    }
+    QPushButton#menuButton:hover {
+        background-color: #e2e8f0;
+    }
+    QPushButton#menuButton:pressed {
+        background-color: #cbd5e0;
+    }
+    QPushButton#menuButton:disabled {
+        background-color: #f7fafc;
+        color: #a0aec0;
+    }
+    QPushButton#amountButton {
+        background-color: #edf2f7;
+        font-weight: 500;
+    }
+    QPushButton#amountButton:hover {
+        background-color: #e2e8f0;
+    }
+    QListWidget#historyList {
+        border: 1px solid #e2e8f0;
+        border-radius: 8px;
+        font-size: 16px;
+        padding: 8px;
+    }
+"""
+
 class ATMSignals(QObject):
     """自定义信号类，用于在GUI和客户端逻辑之间传递事件"""
     error_message = pyqtSignal(str, str)  # 标题, 消息
@@ -15,9 +113,12 @@ class ATMSignals(QObject):
 class ATMGUI(QMainWindow):
     """现代化ATM图形用户界面"""
 
-    def __init__(self, client=None):
+    def __init__(self, client=None, lazy_pages=True):
         super().__init__()
 
+        # 是否按需创建页面（关闭时在启动时创建全部页面）
+        self.lazy_pages = lazy_pages
+
         # 创建ATM客户端实例（如果没有提供）
         self.client = client if client else ATMClient()
         
@@ -29,6 +130,7 @@ class ATMGUI(QMainWindow):
             "on_pin_verified": self.on_pin_verified, 
             "on_balance_result": self.on_balance_result,
             "on_withdraw_success": self.on_withdraw_success,
+            "on_history_result": self.on_history_result,
             "on_exit": self.on_exit
         })
 
@@ -37,9 +139,9 @@ class ATMGUI(QMainWindow):
         self.signals.error_message.connect(self.show_error)
         self.signals.info_message.connect(self.show_info)
 
-        # 初始化UI
-        self.setup_ui()
+        # 初始化UI（先设置样式表，页面控件创建时直接使用）
         self.setup_styles()
+        self.setup_ui()
 
     def setup_ui(self):
         """设置主界面"""
@@ -53,59 +155,53 @@ class ATMGUI(QMainWindow):
         self.stack = QStackedWidget()
         self.setCentralWidget(self.stack)
 
-        # 创建各个页面
-        self.create_welcome_page()
-        self.create_pin_page()
-        self.create_main_menu_page()
-        self.create_balance_page()
-        self.create_withdraw_page()
+        # 页面在第一次显示时才创建，其余页面在首屏显示后的空闲时间里逐个预建
+        self.pages = {}
+        self.page_builders = {
+            PAGE_WELCOME: self.create_welcome_page,
+            PAGE_PIN: self.create_pin_page,
+            PAGE_MENU: self.create_main_menu_page,
+            PAGE_BALANCE: self.create_balance_page,
+            PAGE_WITHDRAW: self.create_withdraw_page,
+            PAGE_HISTORY: self.create_history_page
+        }
 
         # 显示欢迎页
-        self.stack.setCurrentIndex(0)
+        self.show_page(PAGE_WELCOME)
+        if not self.lazy_pages:
+            self.build_pending_pages(all_at_once=True)
+
+    def ensure_page(self, name):
+        """返回指定页面，尚未创建时立即创建"""
+        page = self.pages.get(name)
+        if page is None:
+            page = self.page_builders[name]()
+            self.pages[name] = page
+            self.stack.addWidget(page)
+        return page
+
+    def show_page(self, name):
+        """切换到指定页面"""
+        self.stack.setCurrentWidget(self.ensure_page(name))
+
+    def build_pending_pages(self, all_at_once=False):
+        """预建尚未创建的页面，空闲时每次只建一个，避免阻塞用户输入"""
+        for name in self.page_builders:
+            if name not in self.pages:
+                self.ensure_page(name)
+                if not all_at_once:
+                    QTimer.singleShot(0, self.build_pending_pages)
+                    return
+
+    def showEvent(self, event):
+        """首屏显示后安排空闲预建"""
+        super().showEvent(event)
+        if self.lazy_pages and len(self.pages) < len(self.page_builders):
+            QTimer.singleShot(IDLE_BUILD_DELAY_MS, self.build_pending_pages)
 
     def setup_styles(self):
         """设置基础样式"""
-        self.setStyleSheet("""
-            QMainWindow {
-                background-color: #f5f7fa;
-            }
-            QFrame#card {
-                background-color: white;
-                border-radius: 12px;
-                border: none;
-                /* box-shadow: 0 4px 12px rgba(0, 0, 0, 0.08); */
-            }
-            QLabel {
-                color: #2d3748;
-                font-size: 16px;
-            }
-            QLineEdit {
-                padding: 12px;
-                border: 1px solid #e2e8f0;
-                border-radius: 8px;
-                background-color: white;
-                font-size: 16px;
-                selection-background-color: #4299e1;
-                selection-color: white;
-            }
-            QLineEdit:focus {
-                border: 1px solid #4299e1;
-            }
-            QPushButton {
-                border: none;
-                border-radius: 8px;
-                padding: 12px 24px;
-                font-size: 16px;
-                font-weight: 500;
-                min-width: 120px;
-            }
-            QPushButton:hover {
-                opacity: 0.9;
-            }
-            QPushButton:pressed {
-                opacity: 0.8;
-            }
-        """)
+        self.setStyleSheet(MAIN_STYLESHEET)
 
     def create_welcome_page(self):
         """创建欢迎页面"""
@@ -138,11 +234,7 @@ class ATMGUI(QMainWindow):
 
         title = QLabel("欢迎使用智能ATM")
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            font-size: 28px; 
-            font-weight: bold; 
-            margin-bottom: 20px;
-        """)
+        title.setObjectName("pageTitle")
         title_layout.addWidget(title)
         card_layout.addWidget(title_container)
 
@@ -173,11 +265,7 @@ class ATMGUI(QMainWindow):
         login_btn.setFixedHeight(50)
         login_btn.setCursor(Qt.PointingHandCursor)
         login_btn.clicked.connect(self.insert_card)
-        login_btn.setStyleSheet("""
-            background-color: #4299e1;
-            color: white;
-            font-weight: 600;
-        """)
+        login_btn.setObjectName("primaryButton")
 
         btn_layout.addStretch()
         btn_layout.addWidget(login_btn)
@@ -189,7 +277,7 @@ class ATMGUI(QMainWindow):
         layout.addWidget(card, stretch=2)
         layout.addStretch(1)
 
-        self.stack.addWidget(page)
+        return page
 
     def create_pin_page(self):
         """创建PIN码输入页面"""
@@ -211,11 +299,7 @@ class ATMGUI(QMainWindow):
         # 标题
         title = QLabel("安全验证")
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            font-size: 28px; 
-            font-weight: bold; 
-            margin-bottom: 20px;
-        """)
+        title.setObjectName("pageTitle")
         card_layout.addWidget(title)
 
         # PIN输入
@@ -247,22 +331,14 @@ class ATMGUI(QMainWindow):
         back_btn = QPushButton("返回")
         back_btn.setFixedHeight(50)
         back_btn.setCursor(Qt.PointingHandCursor)
-        back_btn.clicked.connect(lambda: self.stack.setCurrentIndex(0))
-        back_btn.setStyleSheet("""
-            background-color: #a0aec0;
-            color: white;
-            font-weight: 600;
-        """)
+        back_btn.clicked.connect(lambda: self.show_page(PAGE_WELCOME))
+        back_btn.setObjectName("secondaryButton")
 
         login_btn = QPushButton("确认")
         login_btn.setFixedHeight(50)
         login_btn.setCursor(Qt.PointingHandCursor)
         login_btn.clicked.connect(self.verify_pin)
-        login_btn.setStyleSheet("""
-            background-color: #4299e1;
-            color: white;
-            font-weight: 600;
-        """)
+        login_btn.setObjectName("primaryButton")
 
         btn_layout.addWidget(back_btn)
         btn_layout.addStretch()
@@ -274,7 +350,7 @@ class ATMGUI(QMainWindow):
         layout.addWidget(card, stretch=2)
         layout.addStretch(1)
 
-        self.stack.addWidget(page)
+        return page
 
     def create_main_menu_page(self):
         """创建主菜单页面"""
@@ -296,11 +372,7 @@ class ATMGUI(QMainWindow):
         # 标题
         title = QLabel("主菜单")
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            font-size: 28px; 
-            font-weight: bold; 
-            margin-bottom: 20px;
-        """)
+        title.setObjectName("pageTitle")
         card_layout.addWidget(title)
 
         # 菜单按钮
@@ -314,7 +386,7 @@ class ATMGUI(QMainWindow):
         balance_btn.clicked.connect(self.check_balance)
 
         withdraw_btn = self.create_menu_button("💵", "取款")
-        withdraw_btn.clicked.connect(lambda: self.stack.setCurrentIndex(4))
+        withdraw_btn.clicked.connect(lambda: self.show_page(PAGE_WITHDRAW))
 
         transfer_btn = self.create_menu_button("↔️", "转账")
         transfer_btn.setEnabled(False)  # 示例中未实现
@@ -323,7 +395,7 @@ class ATMGUI(QMainWindow):
         deposit_btn.setEnabled(False)  # 示例中未实现
 
         history_btn = self.create_menu_button("📊", "交易记录")
-        history_btn.setEnabled(False)  # 示例中未实现
+        history_btn.clicked.connect(lambda: self.show_history())
 
         exit_btn = self.create_menu_button("🚪", "退出")
         exit_btn.clicked.connect(self.exit_atm)
@@ -342,7 +414,7 @@ class ATMGUI(QMainWindow):
         layout.addWidget(card, stretch=2)
         layout.addStretch(1)
 
-        self.stack.addWidget(page)
+        return page
 
     def create_menu_button(self, icon, text):
         """创建菜单按钮"""
@@ -367,23 +439,8 @@ class ATMGUI(QMainWindow):
         text_label.setStyleSheet("font-size: 16px; font-weight: 500;")
         layout.addWidget(text_label)
 
-        # 按钮样式
-        btn.setStyleSheet("""
-            QPushButton {
-                background-color: #edf2f7;
-                border-radius: 12px;
-            }
-            QPushButton:hover {
-                background-color: #e2e8f0;
-            }
-            QPushButton:pressed {
-                background-color: #cbd5e0;
-            }
-            QPushButton:disabled {
-                background-color: #f7fafc;
-                color: #a0aec0;
-            }
-        """)
+        # 按钮样式（见 MAIN_STYLESHEET）
+        btn.setObjectName("menuButton")
 
         return btn
 
@@ -407,11 +464,7 @@ class ATMGUI(QMainWindow):
         # 标题
         title = QLabel("账户余额")
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            font-size: 28px; 
-            font-weight: bold; 
-            margin-bottom: 20px;
-        """)
+        title.setObjectName("pageTitle")
 
         # 余额显示
         balance_container = QWidget()
@@ -439,12 +492,8 @@ class ATMGUI(QMainWindow):
         back_btn = QPushButton("返回主菜单")
         back_btn.setFixedHeight(50)
         back_btn.setCursor(Qt.PointingHandCursor)
-        back_btn.clicked.connect(lambda: self.stack.setCurrentIndex(2))
-        back_btn.setStyleSheet("""
-            background-color: #4299e1;
-            color: white;
-            font-weight: 600;
-        """)
+        back_btn.clicked.connect(lambda: self.show_page(PAGE_MENU))
+        back_btn.setObjectName("primaryButton")
 
         btn_container = QWidget()
         btn_layout = QHBoxLayout(btn_container)
@@ -461,7 +510,7 @@ class ATMGUI(QMainWindow):
         layout.addWidget(card, stretch=2)
         layout.addStretch(1)
 
-        self.stack.addWidget(page)
+        return page
 
     def create_withdraw_page(self):
         """创建取款页面"""
@@ -483,11 +532,7 @@ class ATMGUI(QMainWindow):
         # 标题
         title = QLabel("取款服务")
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            font-size: 28px; 
-            font-weight: bold; 
-            margin-bottom: 20px;
-        """)
+        title.setObjectName("pageTitle")
 
         # 取款金额输入
         input_container = QWidget()
@@ -517,15 +562,7 @@ class ATMGUI(QMainWindow):
             btn.setCursor(Qt.PointingHandCursor)
             btn.setFixedHeight(45)
             btn.clicked.connect(lambda _, a=amount: self.withdraw_input.setText(str(a)))
-            btn.setStyleSheet("""
-                QPushButton {
-                    background-color: #edf2f7;
-                    font-weight: 500;
-                }
-                QPushButton:hover {
-                    background-color: #e2e8f0;
-                }
-            """)
+            btn.setObjectName("amountButton")
             amounts_layout.addWidget(btn, i // 3, i % 3)
 
         # 按钮
@@ -537,22 +574,14 @@ class ATMGUI(QMainWindow):
         back_btn = QPushButton("返回")
         back_btn.setFixedHeight(50)
         back_btn.setCursor(Qt.PointingHandCursor)
-        back_btn.clicked.connect(lambda: self.stack.setCurrentIndex(2))
-        back_btn.setStyleSheet("""
-            background-color: #a0aec0;
-            color: white;
-            font-weight: 600;
-        """)
+        back_btn.clicked.connect(lambda: self.show_page(PAGE_MENU))
+        back_btn.setObjectName("secondaryButton")
 
         withdraw_btn = QPushButton("确认取款")
         withdraw_btn.setFixedHeight(50)
         withdraw_btn.setCursor(Qt.PointingHandCursor)
         withdraw_btn.clicked.connect(self.withdraw_money)
-        withdraw_btn.setStyleSheet("""
-            background-color: #4299e1;
-            color: white;
-            font-weight: 600;
-        """)
+        withdraw_btn.setObjectName("primaryButton")
 
         btn_layout.addWidget(back_btn)
         btn_layout.addStretch()
@@ -567,7 +596,72 @@ class ATMGUI(QMainWindow):
         layout.addWidget(card, stretch=2)
         layout.addStretch(1)
 
-        self.stack.addWidget(page)
+        return page
+
+    def create_history_page(self):
+        """创建交易记录页面"""
+        page = QWidget()
+        layout = QVBoxLayout(page)
+        layout.setContentsMargins(40, 40, 40, 40)
+        layout.setSpacing(0)
+
+        # 顶部留白
+        layout.addStretch(1)
+
+        # 创建卡片式容器
+        card = QFrame()
+        card.setObjectName("card")
+        card_layout = QVBoxLayout(card)
+        card_layout.setSpacing(30)
+        card_layout.setContentsMargins(40, 40, 40, 40)
+
+        # 标题
+        title = QLabel("交易记录")
+        title.setAlignment(Qt.AlignCenter)
+        title.setObjectName("pageTitle")
+
+        # 记录列表
+        self.history_list = QListWidget()
+        self.history_list.setObjectName("historyList")
+        self.history_list.setMinimumHeight(240)
+
+        # 按钮
+        btn_container = QWidget()
+        btn_layout = QHBoxLayout(btn_container)
+        btn_layout.setContentsMargins(0, 0, 0, 0)
+        btn_layout.setSpacing(20)
+
+        back_btn = QPushButton("返回主菜单")
+        back_btn.setFixedHeight(50)
+        back_btn.setCursor(Qt.PointingHandCursor)
+        back_btn.clicked.connect(lambda: self.show_page(PAGE_MENU))
+        back_btn.setObjectName("secondaryButton")
+
+        first_btn = QPushButton("最新")
+        first_btn.setFixedHeight(50)
+        first_btn.setCursor(Qt.PointingHandCursor)
+        first_btn.clicked.connect(lambda: self.show_history())
+        first_btn.setObjectName("primaryButton")
+
+        self.history_next_btn = QPushButton("下一页")
+        self.history_next_btn.setFixedHeight(50)
+        self.history_next_btn.setCursor(Qt.PointingHandCursor)
+        self.history_next_btn.clicked.connect(lambda: self.show_history(self.history_cursor))
+        self.history_next_btn.setObjectName("primaryButton")
+
+        btn_layout.addWidget(back_btn)
+        btn_layout.addStretch()
+        btn_layout.addWidget(first_btn)
+        btn_layout.addWidget(self.history_next_btn)
+
+        card_layout.addWidget(title)
+        card_layout.addWidget(self.history_list)
+        card_layout.addWidget(btn_container)
+
+        layout.addWidget(card, stretch=2)
+        layout.addStretch(1)
+
+        return page
 
     def show_error(self, title, message):
         """显示错误消息框"""
@@ -628,28 +722,50 @@ class ATMGUI(QMainWindow):
         
     def on_login_success(self):
         """登录成功回调处理"""
-        self.stack.setCurrentIndex(1)  # 转到PIN输入页面
+        self.show_page(PAGE_PIN)  # 转到PIN输入页面
         
     def on_pin_verified(self):
         """PIN验证成功回调处理"""
-        self.stack.setCurrentIndex(2)  # 转到主菜单
+        self.show_page(PAGE_MENU)  # 转到主菜单
         
     def on_balance_result(self, balance):
         """余额查询结果回调处理"""
+        self.ensure_page(PAGE_BALANCE)
         self.balance_label.setText(f"￥{balance}")
-        self.stack.setCurrentIndex(3)  # 转到余额显示页面
+        self.show_page(PAGE_BALANCE)  # 转到余额显示页面
         
     def on_withdraw_success(self, amount):
         """取款成功回调处理"""
-        self.signals.info_message.emit("取款成功", f"已成功取出 ￥{amount}")
-        self.stack.setCurrentIndex(2)  # 返回主菜单
+        message = f"已成功取出 ￥{amount}"
+        balance = self.client.cached_balance()
+        if balance is not None:
+            # 缓存的余额已在本地扣减，无需再查询服务器
+            message += f"\n当前余额 ￥{balance:.2f}"
+        self.signals.info_message.emit("取款成功", message)
+        self.show_page(PAGE_MENU)  # 返回主菜单
         
+    def on_history_result(self, records, next_cursor):
+        """交易记录查询结果回调处理"""
+        self.ensure_page(PAGE_HISTORY)
+        self.history_list.clear()
+        for record in records:
+            when = datetime.datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            self.history_list.addItem(f"{when}    {record['amount']:+.2f}    余额 ￥{record['balance']:.2f}")
+        if not records:
+            self.history_list.addItem("暂无交易记录")
+        self.history_cursor = next_cursor
+        self.history_next_btn.setEnabled(next_cursor is not None)
+        self.show_page(PAGE_HISTORY)  # 转到交易记录页面
+
     def on_exit(self):
         """退出回调处理"""
-        self.stack.setCurrentIndex(0)  # 返回欢迎页面
+        self.show_page(PAGE_WELCOME)  # 返回欢迎页面
         self.card_input.clear()
-        self.pin_input.clear()
-        self.withdraw_input.clear()    # 业务逻辑方法重构
+        # 尚未创建的页面没有需要清空的输入
+        if PAGE_PIN in self.pages:
+            self.pin_input.clear()
+        if PAGE_WITHDRAW in self.pages:
+            self.withdraw_input.clear()    # 业务逻辑方法重构
     def insert_card(self):
         """插入卡片（输入卡号）"""
         card_number = self.card_input.text().strip()
@@ -669,6 +785,10 @@ class ATMGUI(QMainWindow):
         amount_text = self.withdraw_input.text().strip()
         self.client.process_withdrawal(amount_text)
 
+    def show_history(self, cursor=None):
+        """查询交易记录，cursor 为None时从最新一页开始"""
+        self.client.process_history(cursor)
+
     def exit_atm(self):
         """退出ATM"""
         self.client.process_exit()
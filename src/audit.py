@@ -0,0 +1,400 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+
+from .account_store import open_store, shard_of
+
+logger = logging.getLogger('Audit')
+
+# 审计链文件，每行一个区块
+AUDIT_LOG = 'data/audit.log'
+# 一个区块最多包含的扣款记录数
+MAX_GROUP = 512
+# 扣款按卡号哈希分成多把锁，不同卡的扣款互不阻塞
+LOCK_STRIPES = 64
+# 余额比较的容差
+EPSILON = 1e-6
+
+GENESIS = '0' * 64
+
+
+class AuditWriteError(RuntimeError):
+    """扣款已经执行，但所在区块没能写入审计链；balance 为扣款后的余额"""
+
+    def __init__(self, message, balance):
+        super().__init__(message)
+        self.balance = balance
+
+
+def _canonical(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def merkle_root(entries):
+    """计算记录列表的 Merkle 根；叶子和内部节点使用不同前缀，奇数个节点时最后一个直接上移"""
+    level = [hashlib.sha256(b'\x00' + _canonical(entry)).digest() for entry in entries]
+    if not level:
+        return GENESIS
+    while len(level) > 1:
+        paired = [hashlib.sha256(b'\x01' + level[i] + level[i + 1]).digest()
+                  for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+
+def block_hash(block):
+    """区块哈希覆盖区块头（序号、类型、时间、前一区块哈希、Merkle 根、记录数）"""
+    header = {key: block[key] for key in ("n", "kind", "ts", "prev", "root", "count")}
+    return hashlib.sha256(_canonical(header)).hexdigest()
+
+
+def _read_tail(path):
+    """返回 (最后一个完整区块, 完整部分的字节数)，从文件末尾向前读取"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buffer = b''
+        while pos > 0:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            buffer = f.read(step) + buffer
+            end = buffer.rfind(b'\n')
+            if end == -1:
+                continue
+            start = buffer.rfind(b'\n', 0, end)
+            if start != -1 or pos == 0:
+                return json.loads(buffer[start + 1:end]), pos + end + 1
+    return None, 0
+
+
+class AuditLog:
+    """
+    取款审计链
+
+    每笔扣款生成一条记录（卡号、金额、扣款后余额、时间）。后台线程把排队的记录成组写成一个区块：
+    区块头包含组内记录的 Merkle 根和前一区块的哈希，整组只写一次、fsync 一次，
+    每笔交易只需计算一次叶子哈希。检查点区块记录当时全部账户的余额，作为核对的起点。
+
+    同一张卡的扣款和入队在同一把锁（按卡号哈希选取）内完成，保证每张卡的审计顺序与扣款顺序一致；
+    检查点依次取得全部的锁，期间暂停所有扣款，得到一致的余额切面。调用方等到所在区块落盘后才返回。
+    写入审计链失败后拒绝之后的所有扣款，不再出现没有审计记录的扣款。
+    """
+
+    def __init__(self, path=AUDIT_LOG, max_group=MAX_GROUP, stripes=LOCK_STRIPES):
+        self.path = path
+        self.max_group = max_group
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.cond = threading.Condition()
+        self.pending = []
+        self.queued = 0
+        self.committed = 0
+        self.error = None
+        self.closing = False
+        self.head = None
+
+        if os.path.exists(path):
+            self.head, length = _read_tail(path)
+            if length < os.path.getsize(path):
+                # 上次写区块时崩溃，丢弃不完整的最后一行
+                logger.warning(f"审计链 {path} 末尾有不完整的区块，已截断")
+                with open(path, 'r+b') as f:
+                    f.truncate(length)
+        self.file = open(path, 'ab')
+
+        self._thread = threading.Thread(target=self._committer, daemon=True)
+        self._thread.start()
+
+    def _check_error(self):
+        with self.cond:
+            if self.error is not None:
+                raise RuntimeError(f"审计链写入失败: {self.error}")
+
+    def _enqueue(self, item):
+        """加入待写队列，返回序号（调用方持有对应的锁）"""
+        with self.cond:
+            self.pending.append(item)
+            self.queued += 1
+            self.cond.notify_all()
+            return self.queued
+
+    def _wait(self, seq):
+        with self.cond:
+            while self.committed < seq and self.error is None:
+                self.cond.wait()
+            # 所在区块在出错之前已经落盘的不算失败
+            if self.committed < seq:
+                raise RuntimeError(f"审计链写入失败: {self.error}")
+
+    def debit(self, card, amount, withdraw):
+        """
+        执行扣款并记录审计
+
+        参数:
+            withdraw: 实际扣款的函数，返回新余额或None
+        返回:
+            新余额，扣款失败时返回None
+        审计链已经写入失败时不执行扣款，抛出 RuntimeError；扣款已经执行、但所在区块写入失败时
+        抛出 AuditWriteError，由调用方冲正
+        """
+        with self.locks[shard_of(card, len(self.locks))]:
+            self._check_error()
+            balance = withdraw()
+            if balance is None:
+                return None
+            seq = self._enqueue({"card": card, "amount": amount, "balance": balance, "ts": time.time()})
+        try:
+            self._wait(seq)
+        except RuntimeError as e:
+            raise AuditWriteError(str(e), balance) from e
+        return balance
+
+    def checkpoint(self, store):
+        """写入检查点：记录存储中全部账户的当前余额，期间暂停扣款"""
+        with ExitStack() as stack:
+            for lock in self.locks:
+                stack.enter_context(lock)
+            self._check_error()
+            balances = sorted((card, user["balance"]) for card, user in store.iter_users())
+            seq = self._enqueue(("checkpoint", [{"card": card, "balance": balance} for card, balance in balances]))
+        self._wait(seq)
+        logger.info(f"审计检查点已写入，{len(balances)} 个账户")
+        return len(balances)
+
+    def _next_batch(self):
+        """取出下一个区块的内容：一个检查点，或连续的最多 max_group 条扣款记录"""
+        if isinstance(self.pending[0], tuple):
+            return "checkpoint", self.pending.pop(0)[1], 1
+        count = 0
+        while count < len(self.pending) and count < self.max_group and not isinstance(self.pending[count], tuple):
+            count += 1
+        batch = self.pending[:count]
+        del self.pending[:count]
+        return "debit", batch, count
+
+    def _committer(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closing:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                kind, entries, items = self._next_batch()
+
+            block = {
+                "n": self.head["n"] + 1 if self.head else 0,
+                "kind": kind,
+                "ts": time.time(),
+                "prev": self.head["hash"] if self.head else GENESIS,
+                "root": merkle_root(entries),
+                "count": len(entries),
+            }
+            block["hash"] = block_hash(block)
+            block["entries"] = entries
+            try:
+                self.file.write(_canonical(block) + b'\n')
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                logger.error(f"写入审计链失败: {str(e)}")
+                with self.cond:
+                    self.error = str(e)
+                    self.cond.notify_all()
+                return
+            self.head = {"n": block["n"], "hash": block["hash"]}
+
+            with self.cond:
+                self.committed += items
+                self.cond.notify_all()
+
+    def close(self):
+        """写完队列中的记录后关闭"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self._thread.join()
+        self.file.close()
+
+
+def _check_blocks(lines):
+    """在子进程中重新计算一批区块的 Merkle 根和区块哈希，返回 (序号, 前一哈希, 哈希, 问题)"""
+    results = []
+    for line in lines:
+        try:
+            block = json.loads(line)
+            problem = None
+            if merkle_root(block["entries"]) != block["root"] or len(block["entries"]) != block["count"]:
+                problem = "Merkle 根与区块内记录不符"
+            elif block_hash(block) != block["hash"]:
+                problem = "区块哈希与区块头不符"
+            results.append((block["n"], block["prev"], block["hash"], problem))
+        except (ValueError, KeyError, TypeError) as e:
+            results.append((None, None, None, f"无法解析的区块: {e}"))
+    return results
+
+
+class VerifyReport:
+    """核对结果"""
+
+    def __init__(self):
+        self.blocks = 0
+        self.debits = 0
+        self.checkpoints = 0
+        self.head = GENESIS
+        self.chain_errors = []
+        self.mismatches = []
+
+    @property
+    def ok(self):
+        return not self.chain_errors and not self.mismatches
+
+
+def _replay(block, expected, report):
+    """按区块内容推算各账户余额，发现与审计记录不连续的余额变化"""
+    if block["kind"] == "checkpoint":
+        report.checkpoints += 1
+        balances = {}
+        for entry in block["entries"]:
+            card, balance = entry["card"], entry["balance"]
+            if card in expected and abs(expected[card] - balance) > EPSILON:
+                report.mismatches.append(
+                    f"检查点 #{block['n']}: {card} 余额 {balance}，审计记录推算为 {expected[card]}")
+            balances[card] = balance
+        expected.clear()
+        expected.update(balances)
+        return
+
+    for entry in block["entries"]:
+        report.debits += 1
+        card = entry["card"]
+        if card in expected and abs(expected[card] - entry["amount"] - entry["balance"]) > EPSILON:
+            report.mismatches.append(
+                f"区块 #{block['n']}: {card} 扣款 {entry['amount']} 后余额 {entry['balance']}，"
+                f"按上一条记录应为 {expected[card] - entry['amount']}")
+        expected[card] = entry["balance"]
+
+
+def verify_chain(path, workers=4, batch_size=64):
+    """
+    校验审计链并推算各账户的当前余额
+
+    区块哈希和 Merkle 根的重新计算分批交给进程池并行完成，
+    主线程按顺序检查区块之间的链接并推算余额。
+    返回 (VerifyReport, 推算出的余额)。
+    """
+    report = VerifyReport()
+    expected = {}
+    previous = (None, GENESIS)
+
+    def check_links(results):
+        nonlocal previous
+        for n, prev, digest, problem in results:
+            label = f"区块 #{n}" if n is not None else f"第 {report.blocks + 1} 行"
+            if problem:
+                report.chain_errors.append(f"{label}: {problem}")
+            expected_n = 0 if previous[0] is None else previous[0] + 1
+            if n is not None and (n != expected_n or prev != previous[1]):
+                report.chain_errors.append(f"{label}: 与前一区块的链接断开")
+            previous = (n if n is not None else expected_n, digest)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(path, 'rb') as f:
+        in_flight = []
+        batch = []
+        for line in f:
+            report.blocks += 1
+            batch.append(line)
+            try:
+                _replay(json.loads(line), expected, report)
+            except (ValueError, KeyError, TypeError):
+                # 解析错误由校验进程报告
+                pass
+            if len(batch) >= batch_size:
+                in_flight.append(pool.submit(_check_blocks, batch))
+                batch = []
+                # 限制在途批次数，内存占用与审计链长度无关
+                while len(in_flight) > workers * 2:
+                    check_links(in_flight.pop(0).result())
+        if batch:
+            in_flight.append(pool.submit(_check_blocks, batch))
+        for future in in_flight:
+            check_links(future.result())
+
+    report.head = previous[1]
+    return report, expected
+
+
+def verify(path, store, workers=4):
+    """校验审计链，同时读取存储中的当前余额，并与按审计链推算的余额比较"""
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        chain = pool.submit(verify_chain, path, workers)
+        current = pool.submit(lambda: {card: user["balance"] for card, user in store.iter_users()})
+        report, expected = chain.result()
+        balances = current.result()
+
+    if report.checkpoints == 0:
+        report.chain_errors.append("审计链中没有检查点，无法核对余额")
+        return report
+
+    for card in sorted(set(expected) | set(balances)):
+        if card not in balances:
+            report.mismatches.append(f"当前存储: {card} 不存在，审计记录推算余额为 {expected[card]}")
+        elif card not in expected:
+            report.mismatches.append(f"当前存储: {card} 余额 {balances[card]}，最近的检查点后没有该账户")
+        elif abs(expected[card] - balances[card]) > EPSILON:
+            report.mismatches.append(
+                f"当前存储: {card} 余额 {balances[card]}，审计记录推算为 {expected[card]}")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="取款审计链：校验审计链和当前余额，或写入余额检查点")
+    parser.add_argument('action', choices=['verify', 'checkpoint'],
+                        help="verify 校验审计链和当前余额；checkpoint 写入检查点（服务器停止时使用）")
+    parser.add_argument('--log', default=AUDIT_LOG, help="审计链文件")
+    parser.add_argument('--shards', type=int, default=0, help="使用分片存储（与服务器的 --shards 一致）")
+    parser.add_argument('--lazy', action='store_true', help="使用按需加载模式的 SQLite 存储（与服务器的 --lazy 一致）")
+    parser.add_argument('--workers', type=int, default=4, help="校验区块哈希的进程数")
+    parser.add_argument('--max-report', type=int, default=20, help="最多列出的问题数")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = open_store(args.shards, args.lazy)
+    try:
+        if args.action == 'checkpoint':
+            audit = AuditLog(args.log)
+            count = audit.checkpoint(store)
+            audit.close()
+            print(f"已写入检查点，{count} 个账户")
+            return
+
+        if not os.path.exists(args.log):
+            sys.exit(f"审计链文件不存在: {args.log}")
+        started = time.perf_counter()
+        report = verify(args.log, store, args.workers)
+        print(f"区块: {report.blocks}  扣款记录: {report.debits}  检查点: {report.checkpoints}  "
+              f"用时: {time.perf_counter() - started:.2f} 秒")
+        print(f"最新区块哈希: {report.head}")
+        for problem in (report.chain_errors + report.mismatches)[:args.max_report]:
+            print(problem)
+        if report.ok:
+            print("审计链完整，当前余额与审计记录一致")
+        else:
+            print(f"发现问题: 审计链 {len(report.chain_errors)} 处，余额 {len(report.mismatches)} 处")
+            sys.exit(1)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
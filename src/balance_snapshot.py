@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+logger = logging.getLogger('BalanceSnapshot')
+
+
+class BalanceSnapshot:
+    """某一时刻发布的只读余额表，发布后不再修改"""
+
+    def __init__(self, version, balances, captured_at):
+        self.version = version
+        self.balances = MappingProxyType(balances)
+        # 开始采集时的单调时钟时间，早于此时间完成的写入一定包含在快照中
+        self.captured_at = captured_at
+
+
+class SnapshotPublisher:
+    """
+    余额快照发布器
+
+    后台线程每隔 interval 秒从主存储采集一次余额，生成带版本号的不可变快照并整体替换。
+    BALA 直接读取当前快照，不经过主存储的锁，因此不会与 WDRA 争用。
+    写入仍然只走主存储；会话在快照采集之后自己取过款、快照过期或快照中没有该账户时，
+    回退到主存储读取，保证用户总能看到自己的取款结果。
+    """
+
+    def __init__(self, store, interval=1.0, max_age=None):
+        self.store = store
+        self.interval = interval
+        # 超过该时间未能发布新快照时不再使用旧快照
+        self.max_age = max_age if max_age is not None else interval * 5
+        self.current = None
+        self.version = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self):
+        """采集并发布一个新快照"""
+        captured_at = time.monotonic()
+        balances = dict(self.store.iter_balances())
+        self.version += 1
+        self.current = BalanceSnapshot(self.version, balances, captured_at)
+        logger.debug(f"发布余额快照 v{self.version}，共 {len(balances)} 个账户，"
+                     f"用时 {(time.monotonic() - captured_at) * 1000:.1f} ms")
+        return self.current
+
+    def start(self):
+        """启动后台发布线程"""
+        self.publish()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"余额快照发布已启动，间隔 {self.interval} 秒")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"发布余额快照错误: {str(e)}")
+
+    def get_balance(self, user_id, last_write=0.0):
+        """
+        从快照读取余额，无法保证读到最新值时返回None
+
+        参数:
+            user_id: 卡号
+            last_write: 当前会话最近一次取款完成时的单调时钟时间
+        """
+        snapshot = self.current
+        if snapshot is None or last_write >= snapshot.captured_at:
+            return None
+        if time.monotonic() - snapshot.captured_at > self.max_age:
+            return None
+        return snapshot.balances.get(user_id)
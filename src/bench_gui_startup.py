@@ -0,0 +1,85 @@
+import time
+
+# 尽量早地记录起点，导入PyQt5的时间也计入首屏耗时
+START = time.perf_counter()
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+def run_child(lazy):
+    """在当前进程中启动GUI，测量到第一次绘制的时间后退出，以JSON输出结果"""
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QObject, QEvent, QTimer
+    from .atm_client import ATMClient
+    from .atm_gui import ATMGUI
+    imported = time.perf_counter()
+
+    app = QApplication(sys.argv[:1])
+
+    class FirstPaintFilter(QObject):
+        """记录应用内第一个绘制事件的时间"""
+        painted = None
+
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and self.painted is None:
+                self.painted = time.perf_counter()
+                QTimer.singleShot(0, app.quit)
+            return False
+
+    paint_filter = FirstPaintFilter()
+    app.installEventFilter(paint_filter)
+
+    gui = ATMGUI(ATMClient(), lazy_pages=lazy)
+    constructed = time.perf_counter()
+    gui.show()
+    # 防止没有绘制事件时一直等待
+    QTimer.singleShot(10000, app.quit)
+    app.exec_()
+
+    painted = paint_filter.painted or time.perf_counter()
+    print(json.dumps({
+        "import_ms": (imported - START) * 1000,
+        "construct_ms": (constructed - imported) * 1000,
+        "first_paint_ms": (painted - START) * 1000
+    }))
+
+
+def run_parent(runs, offscreen):
+    """分别以按需建页和一次性建页方式各冷启动若干次，输出中位数"""
+    env = dict(os.environ)
+    if offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+
+    print(f"{'模式':<8}{'导入(ms)':>12}{'构建窗口(ms)':>16}{'首屏绘制(ms)':>16}")
+    for mode in ("lazy", "eager"):
+        results = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-m", "src.bench_gui_startup", "--child", mode],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        median = {key: statistics.median(r[key] for r in results) for key in results[0]}
+        print(f"{mode:<8}{median['import_ms']:>12.1f}{median['construct_ms']:>16.1f}{median['first_paint_ms']:>16.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI 冷启动到首屏绘制的耗时基准")
+    parser.add_argument('--runs', type=int, default=5, help="每种模式的冷启动次数")
+    parser.add_argument('--offscreen', action='store_true', help="使用 offscreen 平台插件，无显示器时也能运行")
+    parser.add_argument('--child', choices=['lazy', 'eager'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child == 'lazy')
+    else:
+        run_parent(args.runs, args.offscreen)
+
+
+if __name__ == "__main__":
+    main()
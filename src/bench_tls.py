@@ -0,0 +1,146 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .atm_client import ATMClient
+from .tls import TLSSessionCache, client_context
+
+BENCH_CARD = "100001"
+BENCH_PIN = "1234"
+
+
+def generate_certificate(directory, key_type):
+    """用 openssl 命令行生成 localhost/127.0.0.1 的自签名证书，返回 (证书, 私钥) 路径"""
+    cert, key = os.path.join(directory, "server.crt"), os.path.join(directory, "server.key")
+    if key_type == "rsa":
+        key_args = ["-newkey", "rsa:2048"]
+    else:
+        key_args = ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"]
+    subprocess.run(
+        ["openssl", "req", "-x509", *key_args, "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port, extra_args):
+    """在独立的工作目录中启动服务器子进程，等到端口可以连接"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.server", "--host", "127.0.0.1", "--port", str(port),
+         "--no-command-log", *extra_args],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"服务器没有在端口 {port} 上启动")
+
+
+def run_sessions(port, sessions, tls_context=None, shared_cache=True):
+    """
+    依次执行 sessions 个会话（连接、HELO、PASS、BALA、BYE），返回 (连接耗时列表, 会话耗时列表, 会话缓存)
+
+    shared_cache 为 False 时每个会话使用新的会话缓存，每次都是完整握手。
+    """
+    cache = TLSSessionCache()
+    connects, totals = [], []
+    for _ in range(sessions):
+        client = ATMClient('127.0.0.1', port, tls_context=tls_context,
+                           tls_sessions=cache if shared_cache else TLSSessionCache())
+        started = time.perf_counter()
+        if not client.connect():
+            raise RuntimeError("连接服务器失败")
+        connected = time.perf_counter()
+        client.insert_card(BENCH_CARD)
+        client.verify_pin(BENCH_PIN)
+        client.check_balance()
+        client.exit()
+        finished = time.perf_counter()
+        connects.append((connected - started) * 1000)
+        totals.append((finished - started) * 1000)
+        if not shared_cache:
+            cache.full += client.tls_sessions.full
+            cache.resumed += client.tls_sessions.resumed
+    return connects, totals, cache
+
+
+def describe(values):
+    values = sorted(values)
+    quantiles = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else [values[0]] * 99
+    return f"{quantiles[49]:>10.2f}{quantiles[94]:>10.2f}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TLS 握手开销基准：明文、每次完整握手、恢复会话三种方式对比")
+    parser.add_argument('--sessions', type=int, default=200, help="每种方式执行的会话数")
+    parser.add_argument('--key', choices=['ec', 'rsa'], default='ec', help="自签名证书的密钥类型")
+    parser.add_argument('--ciphers', help="TLS 1.2 密码套件（OpenSSL 格式），同时用于服务器和客户端")
+    parser.add_argument('--tls12', action='store_true', help="限制为 TLS 1.2（使用会话ID/票据恢复）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger('ATMClient').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "logs"))
+        os.makedirs(os.path.join(directory, "data"))
+        with open(os.path.join(directory, "data", "users.json"), 'w') as f:
+            json.dump({BENCH_CARD: {"password": BENCH_PIN, "balance": 1000.0}}, f)
+        cert, key = generate_certificate(directory, args.key)
+
+        tls_args = ["--tls-cert", cert, "--tls-key", key]
+        if args.ciphers:
+            tls_args += ["--tls-ciphers", args.ciphers]
+        plain_port, tls_port = free_port(), free_port()
+        servers = [start_server(directory, plain_port, []), start_server(directory, tls_port, tls_args)]
+
+        context = client_context(cert, args.ciphers)
+        if args.tls12:
+            context.maximum_version = context.minimum_version
+
+        try:
+            # 预热：建立第一个TLS会话，排除导入和首次连接的开销
+            run_sessions(tls_port, 5, context)
+            modes = [
+                ("明文", run_sessions(plain_port, args.sessions)),
+                ("完整握手", run_sessions(tls_port, args.sessions, context, shared_cache=False)),
+                ("恢复会话", run_sessions(tls_port, args.sessions, context)),
+            ]
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    print(f"会话数: {args.sessions}  证书密钥: {args.key}  "
+          f"协议: {'TLS 1.2' if args.tls12 else 'TLS 1.2/1.3'}  密码套件: {args.ciphers or '默认'}")
+    print(f"{'方式':<8}{'连接p50':>10}{'连接p95':>10}{'会话p50':>10}{'会话p95':>10}{'完整握手':>8}{'恢复':>6}  (ms)")
+    for name, (connects, totals, cache) in modes:
+        print(f"{name:<8}{describe(connects)}{describe(totals)}{cache.full:>8}{cache.resumed:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import datetime
+import json
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger('CashInventory')
+
+# 终端钞箱状态文件
+CASSETTE_FILE = 'data/cassettes.json'
+
+# 每多出一张钞票的代价远大于钞箱磨损代价，保证先按张数最少选择
+NOTE_COST = 1000000
+WEAR_COST = 1000
+# 按日累计的出钞金额保留的天数
+DISPENSED_DAYS = 62
+
+
+class CashInventory:
+    """
+    终端钞箱库存与配钞方案
+
+    库存变化时用动态规划预先算好 0 到 max_amount 之间每个金额的最优配钞方案：
+    张数最少优先，张数相同时优先从剩余张数多的钞箱出钞，使各钞箱磨损均衡。
+    查询某个金额能否配出只是一次查表。
+    出钞金额按本地日期分别累计（dispensed: {"YYYY-MM-DD": 金额}），供日终结算与服务器记录核对。
+    """
+
+    def __init__(self, cassettes, max_amount=5000, max_notes=40, terminal=None, dispensed=None, path=None):
+        # 面额 -> 剩余张数
+        self.cassettes = {int(d): int(n) for d, n in cassettes.items()}
+        self.max_amount = max_amount
+        self.max_notes = max_notes
+        # 终端编号，插卡时随 HELO 发送给服务器，记入交易记录
+        self.terminal = terminal
+        self.dispensed = dict(dispensed) if dispensed else {}
+        self.path = path
+        self.lock = threading.Lock()
+        self.unit = math.gcd(*self.cassettes) if self.cassettes else 1
+        self.table = []
+        self._rebuild()
+
+    @classmethod
+    def load(cls, path=CASSETTE_FILE):
+        """读取钞箱状态文件，文件不存在时返回None（不做配钞检查）"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        return cls(
+            state["cassettes"],
+            max_amount=state.get("max_amount", 5000),
+            max_notes=state.get("max_notes", 40),
+            terminal=state.get("terminal"),
+            dispensed=state.get("dispensed"),
+            path=path
+        )
+
+    def save(self):
+        """保存钞箱状态"""
+        if not self.path:
+            return
+        state = {
+            "terminal": self.terminal,
+            "cassettes": {str(d): n for d, n in sorted(self.cassettes.items(), reverse=True)},
+            "max_amount": self.max_amount,
+            "max_notes": self.max_notes,
+            "dispensed": self.dispensed
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _rebuild(self):
+        """按当前库存重新计算配钞表（有界背包，张数按二进制拆分）"""
+        size = self.max_amount // self.unit + 1
+        fullest = max(self.cassettes.values(), default=0) or 1
+        # cost[i] / plan[i]: 金额 i*unit 的最小代价和对应的 {面额: 张数}
+        cost = [0] + [math.inf] * (size - 1)
+        plan = [{}] + [None] * (size - 1)
+
+        for denomination, count in self.cassettes.items():
+            step = denomination // self.unit
+            # 剩余越少的钞箱，每张钞票的代价越高
+            note_cost = NOTE_COST + WEAR_COST * (fullest - count) // fullest
+            count = min(count, self.max_amount // denomination)
+            k = 1
+            while count > 0:
+                take = min(k, count)
+                count -= take
+                k *= 2
+                width = take * step
+                for i in range(size - 1, width - 1, -1):
+                    previous = cost[i - width]
+                    if previous + take * note_cost < cost[i]:
+                        cost[i] = previous + take * note_cost
+                        new_plan = dict(plan[i - width])
+                        new_plan[denomination] = new_plan.get(denomination, 0) + take
+                        plan[i] = new_plan
+
+        self.table = [
+            p if p is not None and sum(p.values()) <= self.max_notes else None
+            for p in plan
+        ]
+
+    def plan(self, amount):
+        """返回配出该金额的 {面额: 张数}，无法配出时返回None"""
+        if not math.isfinite(amount) or amount != int(amount):
+            return None
+        amount = int(amount)
+        if amount <= 0 or amount > self.max_amount or amount % self.unit:
+            return None
+        with self.lock:
+            return self.table[amount // self.unit]
+
+    def dispense(self, notes):
+        """出钞后扣减库存、累计当天的出钞金额并重新计算配钞表"""
+        with self.lock:
+            for denomination, count in notes.items():
+                self.cassettes[denomination] -= count
+            amount = sum(d * n for d, n in notes.items())
+            today = datetime.date.today().isoformat()
+            self.dispensed[today] = self.dispensed.get(today, 0.0) + amount
+            for day in sorted(self.dispensed)[:-DISPENSED_DAYS]:
+                del self.dispensed[day]
+            self._rebuild()
+            self.save()
+        logger.info(f"出钞 {amount}: {notes}，剩余 {self.cassettes}")
+
+    def describe_limits(self):
+        """向用户说明可取金额的规则"""
+        return f"取款金额须为 {self.unit} 的整数倍、不超过 {self.max_amount}，且单次出钞不超过 {self.max_notes} 张"
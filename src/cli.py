@@ -0,0 +1,221 @@
+import argparse
+import itertools
+import logging
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .atm_client import ATMClient
+from .cash import CashInventory
+from .tls import TLSSessionCache, client_context
+
+
+class ScriptedSession:
+    """
+    脚本中的一个会话，脚本文件每行一个:
+        <卡号> <PIN> [BALA | WDRA <金额>]...
+    空行和以 # 开头的行会被忽略，会话结束时自动发送 BYE。
+    """
+
+    def __init__(self, line_no, card, pin, steps):
+        self.line_no = line_no
+        self.card = card
+        self.pin = pin
+        self.steps = steps
+
+    @classmethod
+    def parse(cls, line_no, line):
+        tokens = line.split()
+        if len(tokens) < 2:
+            raise ValueError(f"第 {line_no} 行: 至少需要卡号和PIN")
+        card, pin, rest = tokens[0], tokens[1], tokens[2:]
+        steps = []
+        i = 0
+        while i < len(rest):
+            command = rest[i].upper()
+            if command == "BALA":
+                steps.append(("BALA", None))
+                i += 1
+            elif command == "WDRA" and i + 1 < len(rest):
+                steps.append(("WDRA", rest[i + 1]))
+                i += 2
+            else:
+                raise ValueError(f"第 {line_no} 行: 无法识别的操作 {rest[i]}")
+        return cls(line_no, card, pin, steps)
+
+
+def load_script(path):
+    """读取会话脚本"""
+    sessions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                sessions.append(ScriptedSession.parse(line_no, line))
+    return sessions
+
+
+class SessionResult:
+    def __init__(self, index, card):
+        self.index = index
+        self.card = card
+        self.ok = True
+        self.error = None
+        self.steps = []
+        self.total = 0.0
+
+    def describe(self):
+        status = "OK" if self.ok else f"FAIL({self.error})"
+        steps = ", ".join(f"{name} {seconds * 1000:.1f}" for name, seconds in self.steps)
+        return f"[#{self.index}] {self.card} {status} {self.total * 1000:.1f} ms ({steps})"
+
+
+def run_session(index, session, host, port, tls_context=None, tls_sessions=None):
+    """用一个独立的 ATMClient 执行脚本会话并计时"""
+    client = ATMClient(host, port, tls_context=tls_context, tls_sessions=tls_sessions)
+    result = SessionResult(index, session.card)
+
+    def on_error(title, message):
+        result.ok = False
+        result.error = f"{title}: {message}"
+
+    client.set_callbacks({"on_error": on_error})
+
+    def step(name, action, *args):
+        started = time.perf_counter()
+        ok = action(*args)
+        result.steps.append((name, time.perf_counter() - started))
+        return ok
+
+    started = time.perf_counter()
+    try:
+        if step("HELO", client.process_card_insertion, session.card) and \
+                step("PASS", client.process_pin_verification, session.pin):
+            for command, argument in session.steps:
+                if command == "BALA":
+                    step("BALA", client.process_balance_check)
+                else:
+                    step("WDRA", client.process_withdrawal, argument)
+            step("BYE", client.process_exit)
+        else:
+            client.disconnect()
+    except Exception as e:
+        result.ok = False
+        result.error = str(e)
+        client.disconnect()
+    result.total = time.perf_counter() - started
+    return result
+
+
+def run_script(sessions, host, port, concurrency, rate, repeat, quiet, tls_context=None):
+    """按设定的并发数和速率回放脚本，逐会话输出耗时并汇总"""
+    # 所有会话共享一个TLS会话缓存，只有最初的连接需要完整握手
+    tls_sessions = TLSSessionCache()
+    jobs = list(enumerate(itertools.chain.from_iterable(itertools.repeat(sessions, repeat)), start=1))
+    results = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker(job):
+        index, session = job
+        if rate > 0:
+            # 第 index 个会话不早于 (index-1)/rate 秒开始
+            delay = started + (index - 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        result = run_session(index, session, host, port, tls_context, tls_sessions)
+        with lock:
+            results.append(result)
+            if not quiet:
+                print(result.describe(), flush=True)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, jobs))
+
+    elapsed = time.perf_counter() - started
+    totals = sorted(result.total * 1000 for result in results)
+    failed = sum(1 for result in results if not result.ok)
+    print(f"会话数: {len(results)}  失败: {failed}  用时: {elapsed:.2f} 秒  "
+          f"吞吐: {len(results) / elapsed:.1f} 会话/秒")
+    if totals:
+        quantiles = statistics.quantiles(totals, n=100, method='inclusive') if len(totals) > 1 else [totals[0]] * 99
+        print(f"会话耗时(ms)  平均: {statistics.mean(totals):.1f}  p50: {quantiles[49]:.1f}  "
+              f"p95: {quantiles[94]:.1f}  p99: {quantiles[98]:.1f}  最大: {totals[-1]:.1f}")
+    if tls_context is not None:
+        print(f"TLS 握手  完整: {tls_sessions.full}  恢复会话: {tls_sessions.resumed}")
+    return failed == 0
+
+
+def run_interactive(host, port, cash=None, tls_context=None):
+    """交互式终端，功能与GUI相同"""
+    client = ATMClient(host, port, cash, tls_context=tls_context)
+    client.set_callbacks({
+        "on_error": lambda title, message: print(f"[{title}] {message}"),
+        "on_balance_result": lambda balance: print(f"当前可用余额: ￥{balance.strip()}"),
+        "on_withdraw_success": lambda amount: print(f"已成功取出 ￥{amount}"),
+        "on_exit": lambda: print("谢谢使用，再见！")
+    })
+
+    try:
+        while True:
+            card = input("请输入您的ID（直接回车退出）: ").strip()
+            if not card:
+                return
+            if not client.process_card_insertion(card):
+                continue
+            if not client.process_pin_verification(input("请输入PIN码: ").strip()):
+                client.disconnect()
+                continue
+
+            while True:
+                choice = input("1) 查询余额  2) 取款  3) 退出 > ").strip()
+                if choice == "1":
+                    client.process_balance_check()
+                elif choice == "2":
+                    client.process_withdrawal(input("请输入取款金额: ").strip())
+                elif choice == "3":
+                    client.process_exit()
+                    break
+    except (EOFError, KeyboardInterrupt):
+        client.disconnect()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="无界面的ATM命令行终端，支持交互使用和脚本化批量回放")
+    parser.add_argument('--host', default='localhost', help="服务器地址")
+    parser.add_argument('--port', type=int, default=2525, help="服务器端口")
+    parser.add_argument('--script', help="会话脚本文件，不指定时进入交互模式")
+    parser.add_argument('--concurrency', type=int, default=1, help="同时进行的会话数")
+    parser.add_argument('--rate', type=float, default=0, help="每秒开始的会话数上限（0 表示不限速）")
+    parser.add_argument('--repeat', type=int, default=1, help="脚本重复执行的次数")
+    parser.add_argument('--quiet', action='store_true', help="只输出汇总结果")
+    parser.add_argument('--verbose', action='store_true', help="输出客户端通信日志")
+    parser.add_argument('--tls-ca', metavar='FILE', help="使用 TLS 连接，并信任该CA证书（自签名时为服务器证书）")
+    parser.add_argument('--tls-ciphers', help="TLS 1.2 使用的密码套件（OpenSSL 格式）")
+    parser.add_argument('--cassettes', help="交互模式下使用的钞箱状态文件（启用本机配钞检查）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.verbose:
+        logging.getLogger('ATMClient').setLevel(logging.WARNING)
+
+    tls_context = client_context(args.tls_ca, args.tls_ciphers) if args.tls_ca else None
+
+    if args.script:
+        ok = run_script(load_script(args.script), args.host, args.port,
+                        args.concurrency, args.rate, args.repeat, args.quiet, tls_context)
+        sys.exit(0 if ok else 1)
+    cash = None
+    if args.cassettes:
+        cash = CashInventory.load(args.cassettes)
+        if cash is None:
+            sys.exit(f"钞箱状态文件不存在: {args.cassettes}")
+    run_interactive(args.host, args.port, cash, tls_context)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import datetime
+import gzip
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('EventLog')
+
+# 单个日志段的大小和时长上限，超过任一项时切换到新段
+MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+MAX_SEGMENT_AGE = 3600
+# 压缩时每个 gzip 块包含的记录数，查询时按块跳过
+BLOCK_RECORDS = 4096
+
+SEGMENT_SUFFIX = '.jsonl'
+COMPRESSED_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.jsonl.gz.idx'
+
+_STOP = object()
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def compress_segment(path, block_records=BLOCK_RECORDS):
+    """
+    把写完的日志段压缩为多块 gzip 文件并生成旁路索引
+
+    每块单独压缩（多个 gzip 成员首尾相连，整体仍是合法的 .gz 文件），
+    索引记录每块的偏移、时间范围和命令集合，以及整段出现过的卡号。
+    先写压缩文件和索引，最后删除原文件，中途崩溃时重启会重新压缩。
+    """
+    base = path[:-len(SEGMENT_SUFFIX)]
+    gz_path, idx_path = base + COMPRESSED_SUFFIX, base + INDEX_SUFFIX
+    blocks = []
+    cards = set()
+
+    with open(path, 'rb') as src, open(gz_path + '.tmp', 'wb') as dst:
+        lines = iter(src)
+        while True:
+            chunk = list(itertools.islice(lines, block_records))
+            if not chunk:
+                break
+            first = last = None
+            commands = set()
+            count = 0
+            for line in chunk:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时写了一半的最后一行
+                    continue
+                count += 1
+                ts = record.get("ts", 0.0)
+                first = ts if first is None else min(first, ts)
+                last = ts if last is None else max(last, ts)
+                if record.get("cmd"):
+                    commands.add(record["cmd"])
+                if record.get("card"):
+                    cards.add(record["card"])
+            if not count:
+                continue
+            data = gzip.compress(b''.join(chunk))
+            blocks.append({
+                "offset": dst.tell(), "length": len(data), "count": count,
+                "first": first, "last": last, "cmds": sorted(commands)
+            })
+            dst.write(data)
+
+    index = {
+        "first": blocks[0]["first"] if blocks else None,
+        "last": blocks[-1]["last"] if blocks else None,
+        "count": sum(block["count"] for block in blocks),
+        "cmds": sorted(set(itertools.chain.from_iterable(block["cmds"] for block in blocks))),
+        "cards": sorted(cards),
+        "blocks": blocks
+    }
+    with open(idx_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(gz_path + '.tmp', gz_path)
+    os.replace(idx_path + '.tmp', idx_path)
+    os.remove(path)
+    logger.info(f"日志段 {path} 已压缩，{index['count']} 条记录，{len(blocks)} 块")
+
+
+class EventLog:
+    """
+    结构化事件日志
+
+    每个事件是一行紧凑的JSON，处理命令的线程只做入队；后台线程批量写入当前段，
+    段的大小或时长超过上限时切换新段，写完的段交给压缩线程压缩并建立索引。
+    """
+
+    def __init__(self, directory, max_bytes=MAX_SEGMENT_BYTES, max_age=MAX_SEGMENT_AGE,
+                 flush_interval=1.0, block_records=BLOCK_RECORDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.block_records = block_records
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue = queue.Queue()
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._bytes = 0
+
+        self._recover()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _recover(self):
+        """处理上次运行留下的未压缩段"""
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+                # 压缩已完成，只是没来得及删除原文件
+                os.remove(path)
+            else:
+                self._compressor.submit(self._compress, path)
+
+    def _compress(self, path):
+        try:
+            compress_segment(path, self.block_records)
+        except Exception as e:
+            logger.error(f"压缩日志段 {path} 失败: {str(e)}")
+
+    def emit(self, event, **fields):
+        """记录一个事件"""
+        fields["ts"] = time.time()
+        fields["ev"] = event
+        self._queue.put(fields)
+
+    def _open_segment(self):
+        now = datetime.datetime.now()
+        name = f"events-{now.strftime('%Y%m%d-%H%M%S-%f')}{SEGMENT_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, 'w', encoding='utf-8', buffering=256 * 1024)
+        self._opened_at = time.time()
+        self._bytes = 0
+
+    def _rotate(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._compressor.submit(self._compress, self._path)
+        self._file = self._path = None
+
+    def _writer(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            batch = [] if item is None else [item]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = _STOP in batch
+            records = [record for record in batch if record is not _STOP]
+            if records:
+                if self._file is None:
+                    self._open_segment()
+                data = ''.join(_dumps(record) + '\n' for record in records)
+                self._file.write(data)
+                self._bytes += len(data.encode('utf-8'))
+
+            if self._file is not None:
+                if stop or self._bytes >= self.max_bytes or time.time() - self._opened_at >= self.max_age:
+                    self._rotate()
+                else:
+                    self._file.flush()
+            if stop:
+                return
+
+    def close(self):
+        """写完队列中的事件，切换并压缩最后一段"""
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._compressor.shutdown(wait=True)
+
+
+def _segment_overlaps(first, last, since, until):
+    if first is None:
+        return False
+    return (since is None or last >= since) and (until is None or first <= until)
+
+
+def _matches(record, card, command, since, until):
+    ts = record.get("ts", 0.0)
+    return ((card is None or record.get("card") == card)
+            and (command is None or record.get("cmd") == command)
+            and (since is None or ts >= since)
+            and (until is None or ts <= until))
+
+
+def _filter_lines(lines, card, command, since, until):
+    # 按卡号查询时先做字节匹配，只解析可能命中的行
+    needle = _dumps({"card": card})[1:-1].encode('utf-8') if card is not None else None
+    for line in lines:
+        if needle is not None and needle not in line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if _matches(record, card, command, since, until):
+            yield record
+
+
+def query(directory, card=None, command=None, since=None, until=None):
+    """
+    按卡号、命令和时间范围查询事件，按时间顺序产出记录
+
+    已压缩的段先看索引：时间范围不重叠、没有该卡号或该命令的段整段跳过，
+    段内再按块的时间范围和命令集合跳过，只解压可能命中的块。
+    """
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(INDEX_SUFFIX):
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if not _segment_overlaps(index["first"], index["last"], since, until):
+                continue
+            if card is not None and card not in index["cards"]:
+                continue
+            if command is not None and command not in index["cmds"]:
+                continue
+            with open(path[:-len(INDEX_SUFFIX)] + COMPRESSED_SUFFIX, 'rb') as f:
+                for block in index["blocks"]:
+                    if not _segment_overlaps(block["first"], block["last"], since, until):
+                        continue
+                    if command is not None and command not in block["cmds"]:
+                        continue
+                    f.seek(block["offset"])
+                    data = gzip.decompress(f.read(block["length"]))
+                    yield from _filter_lines(data.splitlines(), card, command, since, until)
+
+        elif name.endswith(SEGMENT_SUFFIX):
+            if os.path.exists(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+                continue
+            # 正在写入或尚未压缩的段没有索引，顺序扫描
+            with open(path, 'rb') as f:
+                yield from _filter_lines(f, card, command, since, until)
+
+
+def parse_time(text):
+    """解析时间参数：Unix时间戳，或 YYYY-MM-DD[ HH:MM[:SS]]"""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"无法解析的时间: {text}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="查询服务器的结构化事件日志")
+    parser.add_argument('directory', help="事件日志目录（服务器的 --event-log 参数）")
+    parser.add_argument('--card', help="只输出该卡号的事件")
+    parser.add_argument('--cmd', help="只输出该命令的事件，例如 WDRA")
+    parser.add_argument('--since', type=parse_time, help="开始时间")
+    parser.add_argument('--until', type=parse_time, help="结束时间")
+    parser.add_argument('--count', action='store_true', help="只输出匹配的事件数")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    matched = query(args.directory, args.card, args.cmd, args.since, args.until)
+    if args.count:
+        print(sum(1 for _ in matched))
+        return
+    for record in matched:
+        sys.stdout.write(_dumps(record) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import select
+import socket
+import threading
+from collections import deque
+
+from .protocol import LineReader
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='logs/gateway.log',
+    filemode='a',
+    encoding='utf-8'
+)
+logger = logging.getLogger('ATMGateway')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class ConsistentHashRing:
+    """
+    一致性哈希环
+
+    每个节点在环上放置 replicas 个虚拟节点，卡号顺时针找到的第一个虚拟节点即为其所属节点。
+    节点加入或离开时只有约 1/N 的卡号改变归属。
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = set()
+        self._keys = []
+        self._owners = []
+        for node in nodes:
+            self.nodes.add(node)
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def add(self, node):
+        self.nodes.add(node)
+        self._rebuild()
+
+    def remove(self, node):
+        self.nodes.discard(node)
+        self._rebuild()
+
+    def node_for(self, key):
+        """返回卡号所属的节点，环为空时返回None"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class BackendPool:
+    """
+    单个后端服务器的连接池
+
+    服务器在 BYE 后会关闭连接，所以每个连接只服务一个会话；池中预先建立好空闲连接，
+    终端插卡时直接取用，省去建立TCP连接的时间，取走后在后台补齐。
+    """
+
+    def __init__(self, address, size=4, timeout=3.0):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.healthy = True
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self._refilling = False
+
+    def _connect(self):
+        return socket.create_connection(self.address, timeout=self.timeout)
+
+    @staticmethod
+    def _alive(sock):
+        """空闲连接可读说明对端已经关闭（服务器不会主动发送数据）"""
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable
+
+    def acquire(self):
+        """取一个可用连接，池中没有时新建"""
+        while True:
+            with self.lock:
+                sock = self.idle.popleft() if self.idle else None
+            if sock is None:
+                break
+            if self._alive(sock):
+                self.schedule_refill()
+                return sock
+            sock.close()
+        sock = self._connect()
+        self.schedule_refill()
+        return sock
+
+    def schedule_refill(self):
+        with self.lock:
+            if self._refilling or not self.healthy:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.idle) >= self.size or not self.healthy:
+                        return
+                sock = self._connect()
+                with self.lock:
+                    self.idle.append(sock)
+        except OSError as e:
+            logger.warning(f"后端 {self.address} 预建连接失败: {str(e)}")
+        finally:
+            with self.lock:
+                self._refilling = False
+
+    def close_idle(self):
+        with self.lock:
+            while self.idle:
+                self.idle.popleft().close()
+
+    def check(self):
+        """健康检查：完成一次 BYE 往返"""
+        try:
+            with socket.create_connection(self.address, timeout=self.timeout) as sock:
+                sock.sendall(b"BYE\n")
+                return LineReader(sock).readline() == "BYE"
+        except OSError:
+            return False
+
+
+class ATMGateway:
+    """
+    RFC-20232023 路由网关
+
+    终端连接网关，网关按 HELO 中卡号的一致性哈希把会话转发到对应的后端服务器；
+    定期健康检查，节点故障或恢复时调整哈希环，新会话随之路由到新的归属节点。
+    网关只调整路由，不迁移账户：归属改变的卡号在新节点上没有账户时返回 401，
+    计划内的扩容或缩容需要先用 split_accounts 按新的节点列表重新分配账户。
+    """
+
+    def __init__(self, backends, host='0.0.0.0', port=2525, pool_size=4,
+                 check_interval=5.0, replicas=100):
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.check_interval = check_interval
+        self.pools = {f"{h}:{p}": BackendPool((h, p), pool_size) for h, p in backends}
+        self.ring = ConsistentHashRing(self.pools, replicas)
+        self.ring_lock = threading.Lock()
+
+    def start(self):
+        """启动网关"""
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(128)
+            logger.info(f"网关启动于 {self.host}:{self.port}，后端: {', '.join(self.pools)}")
+            print(f"ATM 网关已启动，监听端口 {self.port}")
+
+            self.run_health_checks()
+            threading.Thread(target=self._health_loop, daemon=True).start()
+
+            while True:
+                client_socket, address = self.socket.accept()
+                threading.Thread(
+                    target=self.handle_terminal, args=(client_socket, address), daemon=True
+                ).start()
+
+        except Exception as e:
+            logger.error(f"网关错误: {str(e)}")
+        finally:
+            if self.socket:
+                self.socket.close()
+
+    def _health_loop(self):
+        stop = threading.Event()
+        while not stop.wait(self.check_interval):
+            self.run_health_checks()
+
+    def run_health_checks(self):
+        """检查所有后端，状态变化时更新哈希环（只改变新会话的路由，不迁移账户）"""
+        for name, pool in self.pools.items():
+            healthy = pool.check()
+            pool.healthy = healthy
+            with self.ring_lock:
+                in_ring = name in self.ring.nodes
+                if healthy and not in_ring:
+                    self.ring.add(name)
+                    logger.info(f"后端 {name} 已加入，当前节点: {sorted(self.ring.nodes)}")
+                elif not healthy and in_ring:
+                    self.ring.remove(name)
+                    logger.warning(f"后端 {name} 健康检查失败，已移出，当前节点: {sorted(self.ring.nodes)}")
+            if healthy:
+                pool.schedule_refill()
+            else:
+                pool.close_idle()
+
+    def route(self, card):
+        with self.ring_lock:
+            name = self.ring.node_for(card)
+        return name, self.pools.get(name)
+
+    def handle_terminal(self, client_socket, address):
+        """逐条转发终端消息：HELO 决定后端，其余消息发往当前会话的后端"""
+        reader = LineReader(client_socket)
+        backend = backend_reader = None
+        backend_name = None
+
+        try:
+            while True:
+                message = reader.readline()
+                if message is None:
+                    break
+
+                parts = message.split(' ', 1)
+                command = parts[0]
+
+                if command == "HELO" and len(parts) > 1 and parts[1].split():
+                    # 按卡号路由，其后可能带有终端编号
+                    name, pool = self.route(parts[1].split()[0])
+                    if name != backend_name:
+                        if backend:
+                            backend.close()
+                        backend = backend_reader = backend_name = None
+                        if pool:
+                            try:
+                                backend = pool.acquire()
+                                backend_reader = LineReader(backend)
+                                backend_name = name
+                            except OSError as e:
+                                logger.error(f"连接后端 {name} 失败: {str(e)}")
+
+                if backend:
+                    try:
+                        backend.sendall((message + '\n').encode('utf-8'))
+                        response = backend_reader.readline()
+                    except OSError as e:
+                        logger.error(f"后端 {backend_name} 通信错误: {str(e)}")
+                        response = None
+                    if response is None:
+                        backend.close()
+                        backend = backend_reader = backend_name = None
+                        response = "401 ERROR!"
+                else:
+                    response = "BYE" if command == "BYE" else "401 ERROR!"
+
+                client_socket.sendall((response + '\n').encode('utf-8'))
+
+                if command == "BYE":
+                    break
+
+        except Exception as e:
+            logger.error(f"处理终端 {address} 时出错: {str(e)}")
+        finally:
+            if backend:
+                backend.close()
+            client_socket.close()
+
+
+def split_accounts(path, backends, out_dir, replicas=100):
+    """
+    按哈希环把导出的账户文件（account_tool 导出的 JSON Lines）拆分到各后端，返回 {后端: 账户数}
+
+    输出文件为 out_dir/<host>_<port>.jsonl，用 python -m src.account_tool import 导入对应的后端。
+    """
+    ring = ConsistentHashRing((f"{host}:{port}" for host, port in backends), replicas)
+    os.makedirs(out_dir, exist_ok=True)
+    files, counts = {}, {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                node = ring.node_for(str(json.loads(line)["card"]))
+                if node not in files:
+                    files[node] = open(os.path.join(out_dir, node.replace(':', '_') + '.jsonl'), 'w', encoding='utf-8')
+                files[node].write(line.rstrip('\n') + '\n')
+                counts[node] = counts.get(node, 0) + 1
+    finally:
+        for out in files.values():
+            out.close()
+    return counts
+
+
+def parse_backend(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ATM 路由网关：按卡号一致性哈希把会话分发到多个服务器")
+    parser.add_argument('--host', default='0.0.0.0', help="监听地址")
+    parser.add_argument('--port', type=int, default=2525, help="监听端口")
+    parser.add_argument('--backend', action='append', required=True, type=parse_backend,
+                        metavar='HOST:PORT', help="后端服务器地址，可重复指定")
+    parser.add_argument('--pool-size', type=int, default=4, help="每个后端预建的空闲连接数")
+    parser.add_argument('--check-interval', type=float, default=5.0, help="健康检查间隔（秒）")
+    parser.add_argument('--replicas', type=int, default=100, help="每个节点在哈希环上的虚拟节点数")
+    parser.add_argument('--split-accounts', metavar='FILE',
+                        help="不启动网关，把导出的账户文件（JSON Lines）按 --backend 列表的哈希环拆分到各后端")
+    parser.add_argument('--out-dir', default='accounts-by-backend', help="--split-accounts 的输出目录")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.split_accounts:
+        for node, count in sorted(split_accounts(args.split_accounts, args.backend, args.out_dir,
+                                                 args.replicas).items()):
+            print(f"{node}: {count} 个账户")
+        raise SystemExit(0)
+    gateway = ATMGateway(args.backend, args.host, args.port, args.pool_size,
+                         args.check_interval, args.replicas)
+    gateway.start()
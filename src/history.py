@@ -0,0 +1,119 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('History')
+
+# 交易记录数据库
+HISTORY_DB = 'data/history.db'
+# HIST 每页默认和最多返回的记录数（限制单条响应的长度和一次查询读取的行数）
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 20
+
+
+class HistoryStore:
+    """
+    按账户索引的交易记录
+
+    每次余额变动追加一条记录，seq 在写锁内递增分配。服务器在同一张卡的扣款锁内写入记录，
+    所以同一张卡的记录按 seq 排序即为扣款顺序，最后一条记录的余额就是当前余额。
+    服务器写入时不立即提交，离开扣款锁之后再调用 commit()，并发的多笔记录合并为一次提交。
+    (card, seq) 上建有索引，查询一页只需定位到游标位置再顺序读取 page_size 条，
+    代价与该账户的历史总量无关。
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, card TEXT NOT NULL, ts REAL NOT NULL, "
+            "kind TEXT NOT NULL, amount REAL NOT NULL, balance REAL NOT NULL, terminal TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS history_card_seq ON history (card, seq)")
+        # 日终结算按时间窗口定位序号区间
+        self.conn.execute("CREATE INDEX IF NOT EXISTS history_ts ON history (ts)")
+        self.conn.commit()
+
+    def record(self, card, kind, amount, balance, terminal=None, commit=True):
+        """
+        记录一次余额变动，amount 为变动金额（取款为负数），返回记录序号
+
+        commit 为False时只写入当前事务，由之后的 commit() 提交。
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO history (card, ts, kind, amount, balance, terminal) VALUES (?, ?, ?, ?, ?, ?)",
+                (card, time.time(), kind, amount, balance, terminal)
+            )
+            if commit:
+                self.conn.commit()
+            return cursor.lastrowid
+
+    def commit(self):
+        """提交尚未提交的记录（没有时什么也不做）"""
+        with self.lock:
+            self.conn.commit()
+
+    def page(self, card, cursor=None, page_size=PAGE_SIZE):
+        """
+        按时间倒序读取一页记录
+
+        参数:
+            cursor: 上一页返回的游标，None 表示从最新的记录开始
+        返回:
+            (记录列表, 下一页游标)，没有更多记录时游标为None
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        with self.lock:
+            if cursor is None:
+                rows = self.conn.execute(
+                    "SELECT seq, ts, kind, amount, balance FROM history "
+                    "WHERE card = ? ORDER BY seq DESC LIMIT ?",
+                    (card, page_size + 1)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT seq, ts, kind, amount, balance FROM history "
+                    "WHERE card = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                    (card, cursor, page_size + 1)
+                ).fetchall()
+
+        # 多取一条用于判断是否还有下一页
+        next_cursor = rows[page_size - 1][0] if len(rows) > page_size else None
+        records = [
+            {"seq": seq, "ts": ts, "kind": kind, "amount": amount, "balance": balance}
+            for seq, ts, kind, amount, balance in rows[:page_size]
+        ]
+        return records, next_cursor
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def format_page(records, next_cursor):
+    """
+    编码 HIST 响应:
+        HIST <下一页游标|-> <时间戳>,<金额>,<余额>;...
+    """
+    entries = ';'.join(f"{int(r['ts'])},{r['amount']},{r['balance']}" for r in records)
+    return f"HIST {next_cursor if next_cursor is not None else '-'} {entries}".rstrip()
+
+
+def parse_page(response):
+    """解析 HIST 响应，返回 (记录列表, 下一页游标)，格式错误时抛出 ValueError"""
+    parts = response.strip().split(' ', 2)
+    if parts[0] != "HIST" or len(parts) < 2:
+        raise ValueError(f"无效的HIST响应: {response!r}")
+    next_cursor = None if parts[1] == '-' else int(parts[1])
+    records = []
+    if len(parts) == 3 and parts[2]:
+        for entry in parts[2].split(';'):
+            ts, amount, balance = entry.split(',')
+            records.append({"ts": int(ts), "amount": float(amount), "balance": float(balance)})
+    return records, next_cursor
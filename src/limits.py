@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+
+from .account_store import Journal
+
+logger = logging.getLogger('Limits')
+
+# 取款限额的持久化文件
+LIMITS_SNAPSHOT = 'data/limits.json'
+LIMITS_JOURNAL = 'data/limits.journal'
+
+
+class WithdrawalLimits:
+    """
+    取款限额：单笔上限和滑动窗口（默认24小时）内的累计上限
+
+    每张卡只保存 window_buckets 个按时间分桶的累计金额（默认每小时一个桶），
+    检查时把未过期的桶相加，耗时与历史笔数无关、每张卡占用的内存固定；
+    窗口内没有取款的卡在压缩时被清理。
+    已确认的取款写入追加日志，重启时从快照和日志恢复；尚未确认的预占额度单独保存、只在内存中，
+    不会被压缩写入快照。
+    """
+
+    def __init__(self, per_transaction=0, window_limit=0, bucket_seconds=3600, window_buckets=24,
+                 snapshot_path=LIMITS_SNAPSHOT, journal_path=LIMITS_JOURNAL, compact_every=1000,
+                 clock=time.time):
+        self.per_transaction = per_transaction
+        self.window_limit = window_limit
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.compact_every = compact_every
+        self.clock = clock
+        self.lock = threading.Lock()
+        # 卡号 -> 环形桶数组，每个元素为 [桶编号, 累计金额]；cards 为已确认的取款，pending 为预占的额度
+        self.cards = {}
+        self.pending = {}
+        self.journal = Journal(snapshot_path, journal_path)
+        self.load()
+
+    def _bucket(self):
+        return int(self.clock() // self.bucket_seconds)
+
+    def _add(self, table, card, bucket, amount):
+        """把金额计入 table 中某张卡的某个桶（调用方持有锁）"""
+        buckets = table.get(card)
+        if buckets is None:
+            buckets = table[card] = [[-1, 0.0] for _ in range(self.window_buckets)]
+        slot = buckets[bucket % self.window_buckets]
+        if slot[0] > bucket:
+            # 比该位置上现有的桶还旧，已经滑出窗口
+            return
+        if slot[0] != bucket:
+            # 该位置上是已经滑出窗口的旧桶，直接复用
+            slot[0], slot[1] = bucket, 0.0
+        slot[1] += amount
+
+    def _window_total(self, card, bucket):
+        oldest = bucket - self.window_buckets
+        return sum(
+            total
+            for table in (self.cards, self.pending)
+            for index, total in table.get(card, ())
+            if index > oldest
+        )
+
+    def load(self):
+        """从快照和日志恢复窗口内的累计金额"""
+        with self.lock:
+            self.cards = {}
+            for card, slots in self.journal.read_snapshot({}).items():
+                for bucket, total in slots:
+                    self._add(self.cards, card, bucket, total)
+            for entry in self.journal.replay():
+                self._add(self.cards, entry["id"], entry["b"], entry["a"])
+            self._compact()
+        logger.info(f"加载了 {len(self.cards)} 张卡的取款限额记录")
+
+    def _compact(self):
+        """丢弃过期的桶和卡，把已确认的累计金额写成快照并清空日志（调用方持有锁）"""
+        oldest = self._bucket() - self.window_buckets
+        state = {}
+        for card in list(self.cards):
+            live = [[index, total] for index, total in self.cards[card] if index > oldest and total]
+            if live:
+                state[card] = live
+            else:
+                del self.cards[card]
+        self.journal.compact(state)
+
+    def reserve(self, card, amount):
+        """
+        检查并预占额度，返回 (桶编号, None)；超出限额时返回 (None, 原因)
+
+        预占只在内存中生效，取款成功后用返回的桶编号调用 confirm 写入日志，失败时调用 release 退回。
+        """
+        if self.per_transaction and amount > self.per_transaction:
+            return None, f"超过单笔限额 {self.per_transaction}"
+        with self.lock:
+            bucket = self._bucket()
+            if self.window_limit and self._window_total(card, bucket) + amount > self.window_limit:
+                return None, f"超过累计限额 {self.window_limit}"
+            self._add(self.pending, card, bucket, amount)
+            return bucket, None
+
+    def confirm(self, card, amount, bucket):
+        """取款成功，把预占的额度转为已确认并持久化"""
+        with self.lock:
+            self._unreserve(card, amount, bucket)
+            self._add(self.cards, card, bucket, amount)
+            self.journal.append({"id": card, "b": bucket, "a": amount})
+            if self.journal.entries >= self.compact_every:
+                self._compact()
+
+    def release(self, card, amount, bucket):
+        """取款失败，退回预占的额度"""
+        with self.lock:
+            self._unreserve(card, amount, bucket)
+
+    def _unreserve(self, card, amount, bucket):
+        """退回预占的额度，卡上没有其他预占时删除（调用方持有锁）"""
+        self._add(self.pending, card, bucket, -amount)
+        if not any(total > 1e-9 for _, total in self.pending[card]):
+            del self.pending[card]
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
@@ -0,0 +1,330 @@
+import argparse
+import datetime
+import gzip
+import heapq
+import itertools
+import json
+import re
+import socket
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .protocol import LineReader
+
+# server.log 每条记录的格式: 时间 - 记录器 - 级别 - 内容
+RECORD_RE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (\S+) - (\w+) - (.*)$')
+CONNECT_RE = re.compile(r'^新连接来自 (\(.*\))$')
+RECEIVE_RE = re.compile(r'^收到来自 (\(.*?\)) 的消息: (.*)$', re.S)
+SEND_RE = re.compile(r'^发送到 (\(.*?\)): (.*)$', re.S)
+CLOSE_RE = re.compile(r'^连接关闭: (\(.*\))$')
+
+# 余额会随回放改变，--ignore-amounts 时只比较响应类型
+AMOUNT_RE = re.compile(r'^AMNT:.*$')
+
+
+class LoggedSession:
+    """从日志中还原出的一个会话：开始时间和按顺序的 (相对开始的秒数, 命令, 原响应, 原耗时)"""
+
+    def __init__(self, peer, started):
+        self.peer = peer
+        self.started = started
+        self.commands = []
+        self._pending = None
+
+    def received(self, ts, message):
+        self._pending = (ts, message)
+
+    def sent(self, ts, response):
+        if self._pending is None:
+            return
+        received_at, message = self._pending
+        self._pending = None
+        self.commands.append((received_at - self.started, message, response, ts - received_at))
+
+
+def _parse_time(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S,%f').timestamp()
+
+
+def _open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def read_records(paths):
+    """逐条读取服务器日志记录 (时间戳, 内容)，没有时间前缀的行属于上一条记录（消息中含换行）"""
+    for path in paths:
+        current = None
+        with _open_log(path) as f:
+            for line in f:
+                line = line.rstrip('\n')
+                match = RECORD_RE.match(line)
+                if match:
+                    if current:
+                        yield current
+                    ts, name, _, text = match.groups()
+                    current = (_parse_time(ts), text) if name == 'ATMServer' else None
+                elif current:
+                    current = (current[0], current[1] + '\n' + line)
+        if current:
+            yield current
+
+
+def read_sessions(paths):
+    """
+    流式还原会话，按开始时间顺序产出
+
+    会话在连接关闭后才完整，已关闭的会话先放入按开始时间排序的堆中，
+    等到比它更早开始的会话都已关闭时才产出，回放时才能按原始的开始时间调度。
+    内存中只保留尚未关闭的会话和等待产出的会话；日志结束时仍未关闭的会话一并按开始时间产出。
+    """
+    open_sessions = {}
+    order = itertools.count()
+    # (开始时间, 序号, 对端, 会话)，其中已关闭或被替换的会话在取最早时跳过
+    open_heap = []
+    closed = []
+
+    def opened(peer, ts):
+        session = open_sessions[peer] = LoggedSession(peer, ts)
+        heapq.heappush(open_heap, (ts, next(order), peer, session))
+        return session
+
+    def oldest_open():
+        while open_heap and open_sessions.get(open_heap[0][2]) is not open_heap[0][3]:
+            heapq.heappop(open_heap)
+        return open_heap[0][0] if open_heap else None
+
+    for ts, text in read_records(paths):
+        match = RECEIVE_RE.match(text)
+        if match:
+            peer, message = match.groups()
+            session = open_sessions.get(peer)
+            if session is None:
+                # 日志开始前就已建立的连接
+                session = opened(peer, ts)
+            session.received(ts, message)
+            continue
+
+        match = SEND_RE.match(text)
+        if match:
+            peer, response = match.groups()
+            session = open_sessions.get(peer)
+            if session:
+                session.sent(ts, response)
+            continue
+
+        match = CONNECT_RE.match(text)
+        if match:
+            opened(match.group(1), ts)
+            continue
+
+        match = CLOSE_RE.match(text)
+        if match:
+            session = open_sessions.pop(match.group(1), None)
+            if session and session.commands:
+                heapq.heappush(closed, (session.started, next(order), session))
+            limit = oldest_open()
+            while closed and (limit is None or closed[0][0] <= limit):
+                yield heapq.heappop(closed)[2]
+
+    for session in open_sessions.values():
+        if session.commands:
+            heapq.heappush(closed, (session.started, next(order), session))
+    while closed:
+        yield heapq.heappop(closed)[2]
+
+
+class ReplayStats:
+    """回放结果汇总：按命令统计原耗时和回放耗时，记录响应不一致的命令"""
+
+    def __init__(self, max_examples=10):
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.commands = 0
+        self.errors = 0
+        self.mismatches = 0
+        self.examples = []
+        self.max_examples = max_examples
+        self.original = defaultdict(list)
+        self.replayed = defaultdict(list)
+
+    def add_command(self, command, original, replayed, expected, actual, matched):
+        with self.lock:
+            self.commands += 1
+            self.original[command].append(original * 1000)
+            self.replayed[command].append(replayed * 1000)
+            if not matched:
+                self.mismatches += 1
+                if len(self.examples) < self.max_examples:
+                    self.examples.append((command, expected, actual))
+
+    def add_session(self, ok):
+        with self.lock:
+            self.sessions += 1
+            if not ok:
+                self.errors += 1
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def summarize(samples):
+    """{命令: 耗时列表} -> {命令: {"count", "p50", "p95"}}"""
+    return {
+        command: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+        for command, values in samples.items()
+    }
+
+
+def replies_match(expected, actual, ignore_amounts):
+    if ignore_amounts and AMOUNT_RE.match(expected) and actual is not None and AMOUNT_RE.match(actual):
+        return True
+    return expected == actual
+
+
+def replay_session(session, host, port, speed, ignore_amounts, stats, timeout):
+    """在独立连接上按原顺序重发会话中的命令，speed 为0时不等待"""
+    started = time.perf_counter()
+    ok = True
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            reader = LineReader(sock)
+            for offset, message, expected, original in session.commands:
+                if speed > 0:
+                    delay = started + offset / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                sent_at = time.perf_counter()
+                sock.sendall((message + '\n').encode('utf-8'))
+                actual = reader.readline()
+                elapsed = time.perf_counter() - sent_at
+                command = message.split(' ', 1)[0]
+                stats.add_command(command, original, elapsed, expected, actual,
+                                  replies_match(expected, actual, ignore_amounts))
+                if actual is None:
+                    ok = False
+                    break
+    except OSError:
+        ok = False
+    stats.add_session(ok)
+
+
+def run_replay(sessions, host, port, speed=1.0, workers=64, ignore_amounts=False, timeout=10.0):
+    """
+    按日志中的时间关系回放会话
+
+    speed 为1时按原始时间回放，为N时加速N倍，为0时不等待、以 workers 个并发尽快回放。
+    会话边读边调度，同时在途的会话数受 workers 限制。
+    """
+    stats = ReplayStats()
+    slots = threading.Semaphore(workers * 2)
+    first = None
+    started = time.perf_counter()
+
+    def task(session):
+        try:
+            replay_session(session, host, port, speed, ignore_amounts, stats, timeout)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for session in sessions:
+            if first is None:
+                first = session.started
+            if speed > 0:
+                delay = started + (session.started - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            pool.submit(task, session)
+
+    return stats, time.perf_counter() - started
+
+
+def find_regressions(current, reference, threshold, min_delta):
+    """p95 同时超过参考值的 threshold 倍和参考值加 min_delta 毫秒时视为退化"""
+    regressions = []
+    for command, summary in sorted(current.items()):
+        base = reference.get(command)
+        if not base:
+            continue
+        limit = max(base["p95"] * threshold, base["p95"] + min_delta)
+        if summary["p95"] > limit:
+            regressions.append((command, base["p95"], summary["p95"]))
+    return regressions
+
+
+def print_report(stats, elapsed, reference, reference_name, threshold, min_delta):
+    """
+    输出回放报告，返回 (回放耗时统计, 退化列表)
+
+    日志中的原耗时是服务器端的处理时间（毫秒精度），回放耗时是客户端测得的往返时间，
+    两者不可比，只作对照显示；只有指定了之前保存的回放结果（reference）时才判断退化。
+    """
+    replayed = summarize(stats.replayed)
+    original = summarize(stats.original)
+    print(f"会话数: {stats.sessions}  连接失败/中断: {stats.errors}  命令数: {stats.commands}  "
+          f"响应不一致: {stats.mismatches}  用时: {elapsed:.2f} 秒  "
+          f"吞吐: {stats.commands / elapsed if elapsed else 0:.1f} 命令/秒")
+    print(f"{'命令':<6}{'次数':>8}{'原p50':>10}{'原p95':>10}{'回放p50':>10}{'回放p95':>10}  (ms)")
+    for command in sorted(replayed):
+        r, o = replayed[command], original[command]
+        print(f"{command:<6}{r['count']:>8}{o['p50']:>10.2f}{o['p95']:>10.2f}{r['p50']:>10.2f}{r['p95']:>10.2f}")
+
+    for command, expected, actual in stats.examples:
+        print(f"响应不一致 {command}: 期望 {expected!r}，实际 {actual!r}")
+
+    if reference is None:
+        print("未指定 --baseline，不判断耗时退化")
+        return replayed, []
+    regressions = find_regressions(replayed, reference, threshold, min_delta)
+    for command, before, after in regressions:
+        print(f"耗时退化 {command}: p95 {before:.2f} ms -> {after:.2f} ms（参考: {reference_name}）")
+    return replayed, regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="把服务器日志还原为会话并回放，检查响应一致性和耗时退化")
+    parser.add_argument('logs', nargs='+', help="服务器日志文件（按时间顺序，支持 .gz）")
+    parser.add_argument('--host', default='127.0.0.1', help="服务器地址")
+    parser.add_argument('--port', type=int, default=2525, help="服务器端口")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速，1 为原始时间，0 为不等待尽快回放")
+    parser.add_argument('--workers', type=int, default=64, help="同时回放的会话数上限")
+    parser.add_argument('--ignore-amounts', action='store_true', help="只比较 AMNT 响应的类型，不比较余额数值")
+    parser.add_argument('--baseline', help="以之前保存的回放结果作为耗时参考，未指定时只报告耗时、不判断退化")
+    parser.add_argument('--save-baseline', help="把本次回放的耗时统计保存为参考文件")
+    parser.add_argument('--threshold', type=float, default=1.2, help="p95 超过参考值的倍数视为退化")
+    parser.add_argument('--min-delta', type=float, default=1.0, help="p95 至少比参考值多出的毫秒数才视为退化")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    reference, reference_name = None, None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            reference, reference_name = json.load(f), args.baseline
+
+    stats, elapsed = run_replay(read_sessions(args.logs), args.host, args.port, args.speed,
+                                args.workers, args.ignore_amounts)
+    replayed, regressions = print_report(stats, elapsed, reference, reference_name,
+                                         args.threshold, args.min_delta)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(replayed, f, indent=2, ensure_ascii=False)
+
+    sys.exit(1 if stats.mismatches or stats.errors or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
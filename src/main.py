@@ -2,13 +2,15 @@ import sys
 from PyQt5.QtWidgets import QApplication
 from .atm_gui import ATMGUI
 from .atm_client import ATMClient
+from .cash import CashInventory
 
 
 def main():
     app = QApplication(sys.argv)
 
     # 创建ATM客户端实例
-    client = ATMClient(host='10.244.203.114', port=2525)
+    # 钞箱状态文件存在时启用本机配钞检查
+    client = ATMClient(host='10.244.203.114', port=2525, cash=CashInventory.load())
 
     # 创建GUI并传入客户端实例
     gui = ATMGUI(client)
@@ -0,0 +1,452 @@
+import argparse
+import hashlib
+import heapq
+import itertools
+import logging
+import random
+import socket
+import statistics
+import sys
+
+from .account_store import JsonAccountStore
+from .history import HistoryStore
+from .protocol import LineFramer
+from .server import ATMServer, Session
+
+# 丢包后TCP重传的等待时间（秒）
+RETRANSMIT_TIMEOUT = 0.2
+
+
+class EventLoop:
+    """
+    虚拟时钟和事件队列
+
+    事件按 (时间, 加入顺序) 执行，同一时刻的事件按加入顺序执行，结果只取决于输入和随机种子。
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        self._seq = itertools.count()
+
+    def clock(self):
+        return self.now
+
+    def call_at(self, when, callback, *args):
+        heapq.heappush(self._events, (max(when, self.now), next(self._seq), callback, args))
+
+    def call_later(self, delay, callback, *args):
+        self.call_at(self.now + delay, callback, *args)
+
+    def step(self):
+        """执行下一个事件，没有事件时返回False"""
+        if not self._events:
+            return False
+        self.now, _, callback, args = heapq.heappop(self._events)
+        callback(*args)
+        return True
+
+    def run_until(self, done, deadline=None):
+        """执行事件直到 done() 为真；到达 deadline 或没有事件时返回 done() 的结果"""
+        while not done():
+            if not self._events or (deadline is not None and self._events[0][0] > deadline):
+                if deadline is not None:
+                    self.now = max(self.now, deadline)
+                return done()
+            self.step()
+        return True
+
+
+class LinkConfig:
+    """
+    单向链路的参数
+
+    latency/jitter: 每段数据的固定延迟和随机附加延迟（秒）
+    segment: 每次发送被随机切成 1..segment 字节的小段分别到达（0 表示不切分）
+    loss: 每段数据丢失后重传（额外延迟 RETRANSMIT_TIMEOUT）的概率
+    reset: 每段数据导致连接被重置的概率
+    """
+
+    def __init__(self, latency=0.001, jitter=0.0, segment=0, loss=0.0, reset=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.segment = segment
+        self.loss = loss
+        self.reset = reset
+
+
+class SimLink:
+    """可靠有序的单向字节流：数据按链路参数切段、延迟后交给接收方，段之间不会乱序"""
+
+    def __init__(self, network, config, deliver, on_reset):
+        self.network = network
+        self.config = config
+        self.deliver = deliver
+        self.on_reset = on_reset
+        self.last_arrival = 0.0
+
+    def send(self, data):
+        loop, rng, config = self.network.loop, self.network.rng, self.config
+        while data:
+            size = rng.randint(1, config.segment) if config.segment else len(data)
+            chunk, data = data[:size], data[size:]
+            if config.reset and rng.random() < config.reset:
+                loop.call_later(config.latency, self.on_reset)
+                return
+            arrival = loop.now + config.latency + (rng.uniform(0, config.jitter) if config.jitter else 0.0)
+            if config.loss and rng.random() < config.loss:
+                arrival += RETRANSMIT_TIMEOUT
+            self.last_arrival = max(arrival, self.last_arrival)
+            loop.call_at(self.last_arrival, self.deliver, chunk)
+
+
+class SimConnection:
+    """
+    一条仿真连接的服务器端
+
+    收到的数据用 LineFramer 分帧，每条完整消息交给 ATMServer.process_command 处理；
+    服务器处理能力由 workers 个处理单元和每条命令的 service_time 模拟。
+    """
+
+    def __init__(self, network, address):
+        self.network = network
+        self.session = network.session_class(address)
+        self.framer = LineFramer()
+        self.closed = False
+        self.client = None
+        self.to_client = None
+        self.to_server = SimLink(network, network.uplink, self.received, self.reset)
+
+    def received(self, data):
+        if self.closed:
+            return
+        self.network.record('s<', self.session.address, data)
+        for message in self.framer.feed(data):
+            self.network.schedule_command(self, message)
+
+    def execute(self, message):
+        """在服务器上执行一条命令并发回响应"""
+        if self.closed:
+            return
+        command, response = self.network.server.process_command(self.session, message)
+        self.network.commands += 1
+        if command == "WDRA" and response.startswith("525"):
+            card = self.session.user_id
+            self.network.applied[card] = self.network.applied.get(card, 0) + 1
+        self.to_client.send((response + '\n').encode('utf-8'))
+        if command == "BYE":
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.network.loop.call_at(self.to_client.last_arrival, self.client.remote_closed)
+
+    def reset(self):
+        if not self.closed:
+            self.closed = True
+            self.network.resets += 1
+            self.client.remote_reset()
+
+
+class SimSocket:
+    """
+    仿真的客户端socket，接口与阻塞socket相同（connect/sendall/recv/settimeout/close）
+
+    recv 在没有数据时推进事件循环，直到数据到达、连接关闭或超过超时时间（虚拟时间）。
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.connection = None
+        self.buffer = b''
+        self.eof = False
+        self.broken = False
+        self.timeout = None
+        self.on_data = None
+
+    def connect(self, address=None):
+        self.connection = self.network.open_connection(self)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def sendall(self, data):
+        if self.broken:
+            raise ConnectionResetError("连接被重置")
+        if self.connection is None or self.eof:
+            raise BrokenPipeError("连接已关闭")
+        self.network.record('c>', self.connection.session.address, data)
+        self.connection.to_server.send(data)
+
+    def received(self, data):
+        self.buffer += data
+        if self.on_data:
+            self.on_data()
+
+    def remote_closed(self):
+        self.eof = True
+        if self.on_data:
+            self.on_data()
+
+    def remote_reset(self):
+        self.broken = True
+        if self.on_data:
+            self.on_data()
+
+    def recv(self, bufsize):
+        loop = self.network.loop
+        deadline = loop.now + self.timeout if self.timeout is not None else None
+        if not loop.run_until(lambda: self.buffer or self.eof or self.broken, deadline):
+            raise socket.timeout("timed out")
+        if self.buffer:
+            data, self.buffer = self.buffer[:bufsize], self.buffer[bufsize:]
+            return data
+        if self.broken:
+            raise ConnectionResetError("连接被重置")
+        return b''
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.closed = True
+
+
+class SimTerminal:
+    """
+    按脚本执行一个会话的虚拟终端（事件驱动，不占线程）
+
+    每收到一条完整响应记录一次往返时间，经过 think_time 后发送下一条命令。
+    """
+
+    def __init__(self, network, commands, think_time=0.0):
+        self.network = network
+        self.commands = list(commands)
+        self.think_time = think_time
+        self.framer = LineFramer()
+        self.sock = SimSocket(network)
+        self.sock.on_data = self.on_data
+        self.responses = []
+        self.latencies = []
+        self.error = None
+        self.done = False
+        self.sent_at = 0.0
+        self.index = 0
+
+    def start(self):
+        self.sock.connect()
+        self.send_next()
+
+    def send_next(self):
+        if self.index >= len(self.commands):
+            self.finish()
+            return
+        self.sent_at = self.network.loop.now
+        try:
+            self.sock.sendall((self.commands[self.index] + '\n').encode('utf-8'))
+        except OSError as e:
+            self.finish(str(e))
+
+    def on_data(self):
+        if self.done:
+            return
+        data, self.sock.buffer = self.sock.buffer, b''
+        for response in self.framer.feed(data):
+            command = self.commands[self.index].split(' ', 1)[0]
+            self.responses.append(response)
+            self.latencies.append((command, self.network.loop.now - self.sent_at))
+            self.index += 1
+            self.network.loop.call_later(self.think_time, self.send_next)
+        if self.sock.broken:
+            self.finish("连接被重置")
+        elif self.sock.eof and self.index < len(self.commands):
+            self.finish("连接提前关闭")
+
+    def finish(self, error=None):
+        if not self.done:
+            self.done = True
+            self.error = error
+            self.sock.close()
+
+
+class MemoryAccountStore(JsonAccountStore):
+    """只在内存中的账户存储，接口与 JsonAccountStore 相同，仿真时避免每笔取款写文件"""
+
+    def __init__(self, users):
+        self.initial = users
+        super().__init__(path=None)
+
+    def load_users(self):
+        return {user_id: dict(record) for user_id, record in self.initial.items()}
+
+    def save_users(self):
+        pass
+
+
+class SimNetwork:
+    """
+    进程内的仿真网络，把客户端连接接到一个 ATMServer 上
+
+    参数:
+        server: ATMServer 实例，只使用其 process_command（不启动监听）
+        uplink/downlink: 客户端到服务器、服务器到客户端方向的 LinkConfig
+        workers/service_time: 服务器的处理单元数和每条命令的处理时间（虚拟秒）
+    """
+
+    def __init__(self, server, seed=0, uplink=None, downlink=None, workers=1, service_time=0.0):
+        self.server = server
+        self.session_class = Session
+        # 服务器已执行成功的取款笔数（按卡号），客户端可能因连接重置没有收到确认
+        self.applied = {}
+        self.loop = EventLoop()
+        self.rng = random.Random(seed)
+        self.uplink = uplink if uplink is not None else LinkConfig()
+        self.downlink = downlink if downlink is not None else LinkConfig()
+        self.service_time = service_time
+        self.busy_until = [0.0] * workers
+        self.commands = 0
+        self.resets = 0
+        self._ports = itertools.count(10000)
+        self._digest = hashlib.sha256()
+
+    def record(self, direction, address, data):
+        """把每次数据到达计入事件摘要，相同输入和种子的两次仿真摘要相同"""
+        self._digest.update(f"{self.loop.now:.9f} {direction} {address}".encode('utf-8') + data)
+
+    @property
+    def digest(self):
+        return self._digest.hexdigest()[:16]
+
+    def socket(self):
+        """供 ATMClient(socket_factory=...) 使用的socket工厂"""
+        return SimSocket(self)
+
+    def open_connection(self, sock):
+        port = next(self._ports)
+        address = (f"10.{port >> 16 & 255}.{port >> 8 & 255}.{port & 255}", port)
+        connection = SimConnection(self, address)
+        connection.client = sock
+        connection.to_client = SimLink(self, self.downlink, sock.received, connection.reset)
+        return connection
+
+    def schedule_command(self, connection, message):
+        """交给最早空闲的处理单元，处理完成时执行命令"""
+        index = min(range(len(self.busy_until)), key=self.busy_until.__getitem__)
+        finish = max(self.loop.now, self.busy_until[index]) + self.service_time
+        self.busy_until[index] = finish
+        self.loop.call_at(finish, connection.execute, message)
+
+    def add_terminal(self, commands, start_at=0.0, think_time=0.0):
+        terminal = SimTerminal(self, commands, think_time)
+        self.loop.call_at(start_at, terminal.start)
+        return terminal
+
+    def run(self, until=None):
+        """执行到没有事件（或到达虚拟时间 until）为止"""
+        self.loop.run_until(lambda: False, until)
+
+
+def simulate(users, sessions=1000, seed=0, arrival_rate=500.0, uplink=None, downlink=None,
+             workers=1, service_time=0.0002, think_time=0.5, withdraw_amount=10.0):
+    """
+    生成随机会话并仿真，返回 (SimNetwork, 终端列表, 初始余额, 最终存储)
+
+    每个会话随机选一个账户，依次 HELO/PASS/BALA/WDRA/BALA/BYE；会话开始时间服从泊松到达。
+    """
+    rng = random.Random(seed)
+    store = MemoryAccountStore(users)
+    server = ATMServer(store=store, history=HistoryStore(':memory:'))
+    network = SimNetwork(server, seed, uplink, downlink, workers, service_time)
+
+    cards = sorted(users)
+    start = 0.0
+    terminals = []
+    for _ in range(sessions):
+        start += rng.expovariate(arrival_rate)
+        card = rng.choice(cards)
+        commands = [f"HELO {card}", f"PASS {users[card]['password']}", "BALA",
+                    f"WDRA {withdraw_amount}", "BALA", "BYE"]
+        terminals.append(network.add_terminal(commands, start, think_time))
+
+    network.run()
+    return network, terminals, {card: user["balance"] for card, user in users.items()}, store
+
+
+def check_balances(network, initial, store, amount):
+    """核对每个账户的最终余额 = 初始余额 - 服务器执行成功的取款笔数 * 金额，返回不一致的账户列表"""
+    broken = []
+    for card, balance in initial.items():
+        expected = balance - network.applied.get(card, 0) * amount
+        actual = store.get_user(card)["balance"]
+        if abs(expected - actual) > 1e-6:
+            broken.append((card, expected, actual))
+    return broken
+
+
+def unconfirmed_withdrawals(network, terminals):
+    """服务器已扣款但终端没有收到确认的取款笔数（连接重置时会出现）"""
+    confirmed = sum(
+        1 for terminal in terminals
+        for command, response in zip(terminal.commands, terminal.responses)
+        if command.startswith("WDRA") and response.startswith("525")
+    )
+    return sum(network.applied.values()) - confirmed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="进程内确定性网络仿真：在虚拟时间内运行大量并发会话")
+    parser.add_argument('--sessions', type=int, default=5000, help="会话数")
+    parser.add_argument('--accounts', type=int, default=100, help="参与仿真的账户数（卡号越少争用越多）")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子，相同参数和种子的结果完全相同")
+    parser.add_argument('--rate', type=float, default=500.0, help="每秒新到达的会话数（虚拟时间）")
+    parser.add_argument('--latency', type=float, default=0.005, help="单向延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.002, help="附加随机延迟上限（秒）")
+    parser.add_argument('--segment', type=int, default=0, help="把每次发送切成至多该字节数的小段（0 表示不切分）")
+    parser.add_argument('--loss', type=float, default=0.0, help="每段数据丢失重传的概率")
+    parser.add_argument('--reset', type=float, default=0.0, help="每段数据导致连接重置的概率")
+    parser.add_argument('--workers', type=int, default=1, help="服务器处理单元数")
+    parser.add_argument('--service-time', type=float, default=0.0002, help="每条命令的处理时间（秒）")
+    parser.add_argument('--think-time', type=float, default=0.5, help="终端两条命令之间的间隔（秒）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # 仿真时服务器每条命令都会写日志，只保留警告以上
+    logging.getLogger().setLevel(logging.WARNING)
+
+    users = {f"{6200000000 + i}": {"password": "1234", "balance": 1000.0} for i in range(args.accounts)}
+    link = LinkConfig(args.latency, args.jitter, args.segment, args.loss, args.reset)
+    network, terminals, initial, store = simulate(
+        users, args.sessions, args.seed, args.rate, link, link,
+        args.workers, args.service_time, args.think_time
+    )
+
+    failed = [terminal for terminal in terminals if terminal.error or not terminal.done]
+    latencies = {}
+    for terminal in terminals:
+        for command, seconds in terminal.latencies:
+            latencies.setdefault(command, []).append(seconds * 1000)
+
+    elapsed = network.loop.now
+    print(f"会话数: {len(terminals)}  失败: {len(failed)}  连接重置: {network.resets}  "
+          f"命令数: {network.commands}  虚拟用时: {elapsed:.2f} 秒  "
+          f"吞吐: {network.commands / elapsed if elapsed else 0:.1f} 命令/秒")
+    for command in sorted(latencies):
+        values = sorted(latencies[command])
+        quantiles = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else [values[0]] * 99
+        print(f"{command:<5} 次数: {len(values):>6}  p50: {quantiles[49]:.2f} ms  "
+              f"p99: {quantiles[98]:.2f} ms  最大: {values[-1]:.2f} ms")
+
+    print(f"服务器已扣款但终端未收到确认的取款: {unconfirmed_withdrawals(network, terminals)}")
+    broken = check_balances(network, initial, store, 10.0)
+    for card, expected, actual in broken[:10]:
+        print(f"余额不一致 {card}: 应为 {expected}，实际 {actual}")
+    print(f"事件序列摘要: {network.digest}")
+    sys.exit(1 if broken else 0)
+
+
+if __name__ == "__main__":
+    main()
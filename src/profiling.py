@@ -0,0 +1,156 @@
+import datetime
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('Profiling')
+
+# 性能剖析结果输出目录
+PROFILE_DIR = 'logs'
+
+
+class NullTrace:
+    """未开启追踪时使用的空追踪，所有计时调用都不做任何事"""
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class CommandTrace:
+    """
+    单条命令的分阶段计时
+
+    每次调用 mark(stage) 把距上一次 mark 的时间记到该阶段上，
+    同一阶段出现多次时累加（例如收到和发送后各记一次日志）。
+    """
+
+    __slots__ = ('session_id', 'started', 'last', 'stages')
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.started = time.time()
+        self.last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self.last)
+        self.last = now
+
+
+class TraceRecorder:
+    """
+    命令追踪记录器
+
+    开启后每条命令生成一条JSON记录（各阶段耗时，单位微秒），
+    由后台线程批量写入文件，处理命令的线程只做入队。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.enabled = False
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def enable(self, path=None):
+        """开启追踪，path 为 JSON Lines 输出文件"""
+        if path:
+            self.path = path
+        if not self.path:
+            raise ValueError("未指定追踪输出文件")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer, daemon=True)
+            self._thread.start()
+        self.enabled = True
+        logger.info(f"命令追踪已开启，输出到 {self.path}")
+
+    def disable(self):
+        self.enabled = False
+        logger.info("命令追踪已关闭")
+
+    def begin(self, session_id):
+        """开始一条命令的计时，未开启时返回空追踪"""
+        return CommandTrace(session_id) if self.enabled else NULL_TRACE
+
+    def finish(self, trace, address, user_id, command, response):
+        """结束一条命令的计时并提交记录"""
+        if trace is NULL_TRACE:
+            return
+        stages = {stage: round(seconds * 1e6, 1) for stage, seconds in trace.stages.items()}
+        self._queue.put({
+            "ts": trace.started,
+            "session": trace.session_id,
+            "peer": f"{address[0]}:{address[1]}",
+            "card": user_id,
+            "cmd": command,
+            "status": response.split(' ', 1)[0].split(':', 1)[0],
+            # recv 阶段包含等待用户操作的时间，不计入服务耗时
+            "service_us": round(sum(v for k, v in stages.items() if k != 'recv'), 1),
+            "stages": stages,
+        })
+
+    def _writer(self):
+        while True:
+            records = [self._queue.get()]
+            while not self._queue.empty() and len(records) < 1000:
+                records.append(self._queue.get_nowait())
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+            except Exception as e:
+                logger.error(f"写入追踪记录错误: {str(e)}")
+
+
+class Profiler:
+    """
+    运行中服务器的限时统计采样剖析
+
+    后台定时采集所有线程的调用栈，结束后按调用栈聚合次数，输出 folded 格式
+    （每行 "栈帧;栈帧;... 次数"，可直接用 flamegraph 等工具生成火焰图）。
+    采样不需要修改会话线程，也不依赖 cProfile 的线程模型，对服务器影响很小。
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+
+    def run(self, duration, interval=0.005):
+        """执行一次限时采样，返回结果文件路径"""
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("已有剖析正在进行")
+        try:
+            logger.info(f"开始采样剖析，持续 {duration} 秒，间隔 {interval * 1000:.1f} ms")
+            me = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+                    names = []
+                    while frame is not None:
+                        code = frame.f_code
+                        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(names))] += 1
+                samples += 1
+                time.sleep(interval)
+
+            stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(self.output_dir, f"profile-{stamp}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"采样 {samples} 次，剖析结果已保存到 {path}")
+            return path
+        finally:
+            self.lock.release()
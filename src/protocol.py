@@ -0,0 +1,69 @@
+import socket
+
+# 未以换行结束的数据在该时间内没有后续数据时视为一条完整消息（秒）
+PARTIAL_TIMEOUT = 0.2
+
+
+class LineFramer:
+    """
+    RFC-20232023 消息分帧
+
+    每条消息以换行结束。一次收到的数据可能包含多条消息，也可能只是一条消息的一部分，
+    feed() 只返回已经完整的消息，剩余部分留在缓冲区中等待后续数据。
+    """
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        """加入收到的数据，返回其中完整的消息列表（已去掉首尾空白）"""
+        self.buffer += data
+        if b'\n' not in self.buffer:
+            return []
+        *lines, self.buffer = self.buffer.split(b'\n')
+        return [line.decode('utf-8').strip() for line in lines if line.strip()]
+
+    def flush(self):
+        """取出缓冲区中未以换行结束的数据作为一条消息，没有时返回None"""
+        data, self.buffer = self.buffer.strip(), b''
+        return data.decode('utf-8') if data else None
+
+
+class LineReader:
+    """
+    在阻塞socket上按消息读取
+
+    兼容不发送换行的客户端：缓冲区中有不完整的数据、且 partial_timeout 内没有新数据时，
+    把已收到的部分当作一条完整消息返回。
+    """
+
+    def __init__(self, sock, bufsize=1024, partial_timeout=PARTIAL_TIMEOUT):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.partial_timeout = partial_timeout
+        self.framer = LineFramer()
+        self.pending = []
+
+    def readline(self):
+        """读取一条消息，连接关闭时返回None"""
+        while not self.pending:
+            timeout = self.sock.gettimeout()
+            partial = bool(self.framer.buffer)
+            if partial:
+                self.sock.settimeout(self.partial_timeout)
+            try:
+                data = self.sock.recv(self.bufsize)
+            except socket.timeout:
+                if not partial:
+                    raise
+                line = self.framer.flush()
+                if line is not None:
+                    return line
+                continue
+            finally:
+                self.sock.settimeout(timeout)
+
+            if not data:
+                return self.framer.flush()
+            self.pending.extend(self.framer.feed(data))
+        return self.pending.pop(0)
@@ -1,9 +1,21 @@
 import socket
 import threading
-import json
 import logging
-import os
 import datetime
+import argparse
+import itertools
+import sqlite3
+import time
+
+from .account_store import JsonAccountStore, open_store, check_pin, shard_of
+from .balance_snapshot import SnapshotPublisher
+from .profiling import TraceRecorder, Profiler, NULL_TRACE
+from .history import HistoryStore, PAGE_SIZE, format_page
+from .limits import WithdrawalLimits
+from .event_log import EventLog
+from .audit import AuditLog, AuditWriteError
+from .protocol import LineReader
+from .tls import server_context
 
 # 配置日志
 logging.basicConfig(
@@ -15,47 +27,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger('ATMServer')
 
-# 用户数据存储路径
-DATA_FILE = 'data/users.json'
+
+class Session:
+    """单个客户端连接的会话状态"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, address):
+        self.id = next(self._ids)
+        self.address = address
+        self.user_id = None
+        self.authenticated = False
+        # 终端编号（HELO 中携带），旧终端不发送时使用对端地址
+        self.terminal = address[0]
+        # 本会话最近一次取款完成的时间，用于判断快照是否已包含自己的写入
+        self.last_write = 0.0
 
 
 class ATMServer:
-    def __init__(self, host='0.0.0.0', port=2525):
+    def __init__(self, host='0.0.0.0', port=2525, store=None, snapshot_interval=0,
+                 admin_port=0, trace_path=None, history=None, limits=None, events=None,
+                 command_log=True, audit=None, tls_context=None):
         self.host = host
         self.port = port
         self.socket = None
-        self.users = self.load_users()
-
-    def load_users(self):
-        """从文件加载用户数据"""
-        if not os.path.exists(DATA_FILE):
-            # 用户数据
-            default_users = {
-                "123456": {"password": "1234", "balance": 10000.0},
-                "654321": {"password": "4321", "balance": 5000.0}
-            }
-            with open(DATA_FILE, 'w') as f:
-                json.dump(default_users, f, indent=2)
-            logger.info(f"创建默认用户数据文件: {DATA_FILE}")
-            return default_users
-
-        try:
-            with open(DATA_FILE, 'r') as f:
-                users = json.load(f)
-            logger.info(f"从 {DATA_FILE} 加载了 {len(users)} 个用户")
-            return users
-        except Exception as e:
-            logger.error(f"加载用户数据错误: {str(e)}")
-            return {}
-
-    def save_users(self):
-        """保存用户数据到文件"""
-        try:
-            with open(DATA_FILE, 'w') as f:
-                json.dump(self.users, f, indent=2)
-            logger.info(f"保存了 {len(self.users)} 个用户数据到 {DATA_FILE}")
-        except Exception as e:
-            logger.error(f"保存用户数据错误: {str(e)}")
+        # 账户存储（未指定时使用单文件 data/users.json）
+        self.store = store if store is not None else JsonAccountStore()
+        # 交易记录（未指定时使用 data/history.db）
+        self.history = history if history is not None else HistoryStore()
+        # 按卡号哈希选取的扣款锁：扣款和写交易记录在同一把锁内完成，同一张卡的记录顺序与扣款顺序一致
+        self.card_locks = [threading.Lock() for _ in range(64)]
+        # 取款限额（None 表示不限额）
+        self.limits = limits
+        # 余额查询的只读快照（interval 为 0 时BALA直接读主存储）
+        self.snapshots = SnapshotPublisher(self.store, snapshot_interval) if snapshot_interval > 0 else None
+        # 管理端口（只监听本机，0 表示不开启），用于触发剖析和开关追踪
+        self.admin_port = admin_port
+        self.tracer = TraceRecorder(trace_path)
+        self.profiler = Profiler()
+        if trace_path:
+            self.tracer.enable()
+        # 结构化事件日志（None 表示不记录）；command_log 为False时不再把每条命令写入文本日志
+        self.events = events
+        self.command_log = command_log
+        # 取款审计链（None 表示不记录）；新建的审计链先写入一个余额检查点作为起点
+        self.audit = audit
+        if self.audit is not None and self.audit.head is None:
+            self.audit.checkpoint(self.store)
+        # TLS（None 表示明文），握手在各连接自己的线程中进行，不阻塞 accept
+        self.tls_context = tls_context
 
     def start(self):
         """启动服务器"""
@@ -64,7 +84,12 @@ class ATMServer:
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.socket.bind((self.host, self.port))
             self.socket.listen(5)
-            logger.info(f"服务器启动于 {self.host}:{self.port}")
+            logger.info(f"服务器启动于 {self.host}:{self.port}{'（TLS）' if self.tls_context else ''}")
+
+            if self.snapshots:
+                self.snapshots.start()
+            if self.admin_port:
+                self.start_admin()
 
             print(f"ATM 服务器已启动，监听端口 {self.port}")
 
@@ -83,85 +108,325 @@ class ATMServer:
         finally:
             if self.socket:
                 self.socket.close()
+            if self.events:
+                self.events.close()
+            if self.audit is not None:
+                self.audit.close()
 
     def handle_client(self, client_socket, address):
         """处理客户端连接"""
-        user_id = None
-        authenticated = False
+        session = Session(address)
+        peer = f"{address[0]}:{address[1]}"
+        if self.events:
+            self.events.emit("conn", sid=session.id, peer=peer)
 
         try:
+            # 响应都是小报文，关闭Nagle算法避免与客户端的延迟确认叠加
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.tls_context is not None:
+                client_socket = self.tls_context.wrap_socket(client_socket, server_side=True)
+            # 按换行分帧：一次收到多条消息或一条消息分多次到达都能正确处理
+            reader = LineReader(client_socket)
+
             while True:
-                data = client_socket.recv(1024).decode('utf-8').strip()
+                trace = self.tracer.begin(session.id)
+                data = reader.readline()
+                trace.mark('recv')
                 if not data:
                     break
 
-                logger.info(f"收到来自 {address} 的消息: {data}")
+                started = time.perf_counter()
+                if self.command_log:
+                    logger.info(f"收到来自 {address} 的消息: {data}")
+                trace.mark('log')
 
-                parts = data.split(' ', 1)
-                command = parts[0]
+                command, response = self.process_command(session, data, trace)
 
-                if command == "HELO":
-                    if len(parts) > 1:
-                        user_id = parts[1]
-                        if user_id in self.users:
-                            response = "500 AUTH REQUIRED!"
-                        else:
-                            response = "401 ERROR!"
-                    else:
-                        response = "401 ERROR!"
+                client_socket.sendall((response + '\n').encode('utf-8'))
+                trace.mark('send')
+                if self.command_log:
+                    logger.info(f"发送到 {address}: {response}")
+                if self.events:
+                    # 事件日志不记录PIN
+                    message = "PASS ***" if command == "PASS" else data
+                    self.events.emit("cmd", sid=session.id, peer=peer, card=session.user_id, cmd=command,
+                                     msg=message, resp=response,
+                                     us=int((time.perf_counter() - started) * 1000000))
+                trace.mark('log')
+                self.tracer.finish(trace, address, session.user_id, command, response)
 
-                elif command == "PASS":
-                    if user_id and len(parts) > 1:
-                        password = parts[1]
-                        if user_id in self.users and self.users[user_id]["password"] == password:
-                            authenticated = True
-                            response = "525 OK!"
-                        else:
-                            response = "401 ERROR!"
-                    else:
-                        response = "401 ERROR!"
+                if command == "BYE":
+                    break
 
-                elif command == "BALA":
-                    if authenticated:
-                        balance = self.users[user_id]["balance"]
-                        response = f"AMNT:{balance}"
-                    else:
-                        response = "401 ERROR!"
+        except Exception as e:
+            logger.error(f"处理客户端 {address} 时出错: {str(e)}")
+        finally:
+            client_socket.close()
+            logger.info(f"连接关闭: {address}")
+            if self.events:
+                self.events.emit("close", sid=session.id, peer=peer, card=session.user_id)
+
+    def process_command(self, session, data, trace=NULL_TRACE):
+        """处理一条命令，返回 (命令, 响应)"""
+        parts = data.split(' ', 1)
+        command = parts[0]
+        trace.mark('parse')
 
-                elif command == "WDRA":
-                    if authenticated and len(parts) > 1:
+        if command == "HELO":
+            # HELO <卡号> [<终端编号>]
+            args = parts[1].split() if len(parts) > 1 else []
+            if 1 <= len(args) <= 2:
+                session.user_id = args[0]
+                session.terminal = args[1] if len(args) == 2 else session.address[0]
+                if self.store.get_user(session.user_id):
+                    response = "500 AUTH REQUIRED!"
+                else:
+                    response = "401 ERROR!"
+                trace.mark('lookup')
+            else:
+                response = "401 ERROR!"
+
+        elif command == "PASS":
+            if session.user_id and len(parts) > 1:
+                password = parts[1]
+                user = self.store.get_user(session.user_id)
+                if user and check_pin(user["password"], password):
+                    session.authenticated = True
+                    response = "525 OK!"
+                else:
+                    response = "401 ERROR!"
+                trace.mark('lookup')
+            else:
+                response = "401 ERROR!"
+
+        elif command == "BALA":
+            if session.authenticated:
+                balance = None
+                if self.snapshots:
+                    balance = self.snapshots.get_balance(session.user_id, session.last_write)
+                if balance is None:
+                    balance = self.store.get_user(session.user_id)["balance"]
+                response = f"AMNT:{balance}"
+                trace.mark('lookup')
+            else:
+                response = "401 ERROR!"
+
+        elif command == "WDRA":
+            if session.authenticated and len(parts) > 1:
+                try:
+                    amount = float(parts[1])
+                    balance = None
+                    if amount > 0:
                         try:
-                            amount = float(parts[1])
-                            if amount > 0 and self.users[user_id]["balance"] >= amount:
-                                self.users[user_id]["balance"] -= amount
-                                self.save_users()
-                                response = "525 OK"
-                            else:
-                                response = "401 ERROR!"
-                        except ValueError:
-                            response = "401 ERROR!"
+                            balance = self.withdraw(session, amount)
+                        except (RuntimeError, OSError) as e:
+                            # 审计链已失效或存储写入失败，扣款没有执行
+                            logger.error(f"{session.address} 的取款 {amount} 失败: {str(e)}")
+                    if balance is not None:
+                        session.last_write = time.monotonic()
+                        response = "525 OK"
                     else:
                         response = "401 ERROR!"
+                    trace.mark('persist')
+                except ValueError:
+                    response = "401 ERROR!"
+            else:
+                response = "401 ERROR!"
 
-                elif command == "BYE":
-                    response = "BYE"
-
-                else:
+        elif command == "HIST":
+            # HIST [<游标> [<条数>]]
+            args = parts[1].split() if len(parts) > 1 else []
+            if session.authenticated and len(args) <= 2:
+                try:
+                    cursor = int(args[0]) if args and args[0] != '-' else None
+                    page_size = int(args[1]) if len(args) > 1 else PAGE_SIZE
+                    records, next_cursor = self.history.page(session.user_id, cursor, page_size)
+                    response = format_page(records, next_cursor)
+                    trace.mark('lookup')
+                except ValueError:
                     response = "401 ERROR!"
+            else:
+                response = "401 ERROR!"
 
-                client_socket.sendall((response + '\n').encode('utf-8'))
-                logger.info(f"发送到 {address}: {response}")
+        elif command == "BYE":
+            response = "BYE"
 
-                if command == "BYE":
-                    break
+        else:
+            response = "401 ERROR!"
+
+        return command, response
+
+    def withdraw(self, session, amount):
+        """检查限额后扣款，成功返回新余额，失败返回None"""
+        if self.limits is None:
+            return self.debit(session, amount)
+
+        bucket, reason = self.limits.reserve(session.user_id, amount)
+        if reason:
+            logger.info(f"拒绝 {session.address} 的取款 {amount}: {reason}")
+            return None
+        balance = None
+        try:
+            balance = self.debit(session, amount)
+        finally:
+            # 扣款失败或抛出异常时都要退回预占的额度
+            if balance is None:
+                self.limits.release(session.user_id, amount, bucket)
+            else:
+                self.limits.confirm(session.user_id, amount, bucket)
+        return balance
+
+    def debit(self, session, amount):
+        """扣款并写交易记录；开启审计时在审计记录落盘后才返回"""
+        card = session.user_id
+
+        def apply():
+            balance = self.store.withdraw(card, amount)
+            if balance is not None:
+                self.record_history(card, "WDRA", -amount, balance, session.terminal)
+            return balance
 
+        try:
+            if self.audit is None:
+                with self.card_locks[shard_of(card, len(self.card_locks))]:
+                    return apply()
+            try:
+                # 审计链同样按卡号加锁，apply 在其锁内执行，等待落盘时不占用锁
+                return self.audit.debit(card, amount, apply)
+            except AuditWriteError as e:
+                return self.reverse(session, amount, e)
+        finally:
+            # 离开扣款锁之后再提交交易记录，并发的取款合并为一次提交
+            self.commit_history()
+
+    def record_history(self, card, kind, amount, balance, terminal):
+        """在扣款锁内写入交易记录（暂不提交）；失败只记日志，不影响已经完成的扣款"""
+        try:
+            self.history.record(card, kind, amount, balance, terminal, commit=False)
+        except sqlite3.Error as e:
+            logger.error(f"写入交易记录失败（{card} {kind} {amount}，余额 {balance}）: {str(e)}")
+
+    def commit_history(self):
+        """提交已写入的交易记录；失败只记日志，未提交的记录留到下一次提交"""
+        try:
+            self.history.commit()
+        except sqlite3.Error as e:
+            logger.error(f"提交交易记录失败: {str(e)}")
+
+    def reverse(self, session, amount, error):
+        """
+        审计记录没能落盘的扣款：冲正并返回None（按取款失败处理）
+
+        冲正也失败时扣款已无法撤销，返回扣款后的余额，按取款成功处理（出钞、确认限额），
+        这笔扣款之后由审计核对报告出来。
+        """
+        card = session.user_id
+        try:
+            with self.card_locks[shard_of(card, len(self.card_locks))]:
+                balance = self.store.deposit(card, amount)
+                if balance is not None:
+                    self.record_history(card, "REV", amount, balance, session.terminal)
         except Exception as e:
-            logger.error(f"处理客户端 {address} 时出错: {str(e)}")
+            balance, reason = None, str(e)
+        else:
+            reason = "账户不存在"
+        if balance is None:
+            logger.error(f"{card} 的取款 {amount} 未能写入审计链（{error}），冲正也失败: {reason}，保留扣款")
+            return error.balance
+        logger.error(f"{card} 的取款 {amount} 未能写入审计链（{error}），已冲正，余额 {balance}")
+        return None
+
+    def start_admin(self):
+        """启动本机管理端口"""
+        admin_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        admin_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        admin_socket.bind(('127.0.0.1', self.admin_port))
+        admin_socket.listen(1)
+        logger.info(f"管理端口启动于 127.0.0.1:{self.admin_port}")
+
+        def serve():
+            while True:
+                conn, _ = admin_socket.accept()
+                threading.Thread(target=self.handle_admin, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=serve, daemon=True).start()
+
+    def handle_admin(self, conn):
+        """
+        处理管理命令（每个连接一条）:
+            PROF <秒数>         对运行中的服务器做限时采样剖析，返回结果文件路径
+            TRAC ON [文件]      开启命令追踪
+            TRAC OFF            关闭命令追踪
+            CKPT                写入审计检查点（记录全部账户的当前余额）
+        """
+        try:
+            parts = conn.recv(1024).decode('utf-8').split()
+            logger.info(f"收到管理命令: {' '.join(parts)}")
+            try:
+                if len(parts) == 2 and parts[0] == "PROF":
+                    response = f"525 OK {self.profiler.run(float(parts[1]))}"
+                elif len(parts) in (2, 3) and parts[0] == "TRAC" and parts[1] == "ON":
+                    self.tracer.enable(parts[2] if len(parts) == 3 else None)
+                    response = "525 OK"
+                elif len(parts) == 2 and parts[0] == "TRAC" and parts[1] == "OFF":
+                    self.tracer.disable()
+                    response = "525 OK"
+                elif parts == ["CKPT"] and self.audit is not None:
+                    response = f"525 OK {self.audit.checkpoint(self.store)}"
+                else:
+                    response = "401 ERROR!"
+            except (ValueError, RuntimeError) as e:
+                response = f"401 ERROR! {e}"
+            conn.sendall((response + '\n').encode('utf-8'))
+        except Exception as e:
+            logger.error(f"处理管理命令时出错: {str(e)}")
         finally:
-            client_socket.close()
-            logger.info(f"连接关闭: {address}")
+            conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ATM 服务器")
+    parser.add_argument('--host', default='0.0.0.0', help="监听地址")
+    parser.add_argument('--port', type=int, default=2525, help="监听端口")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="按卡号哈希分片存储账户的分片数（0 表示使用单文件 data/users.json）")
+    parser.add_argument('--lazy', action='store_true',
+                        help="按需加载账户：启动时不读取全部账户，首次HELO时从 data/accounts.db 读取")
+    parser.add_argument('--cache-size', type=int, default=10000, help="按需加载模式下缓存的账户数上限")
+    parser.add_argument('--snapshot-interval', type=float, default=0,
+                        help="余额快照的发布间隔（秒），大于0时BALA从只读快照读取，不与取款争用锁")
+    parser.add_argument('--admin-port', type=int, default=0,
+                        help="本机管理端口（0 表示不开启），可发送 PROF/TRAC 命令触发剖析和开关追踪")
+    parser.add_argument('--trace', metavar='FILE', help="开启命令分阶段计时追踪，记录写入指定的 JSON Lines 文件")
+    parser.add_argument('--max-withdrawal', type=float, default=0, help="单笔取款上限（0 表示不限）")
+    parser.add_argument('--daily-limit', type=float, default=0, help="每张卡24小时滑动窗口内的累计取款上限（0 表示不限）")
+    parser.add_argument('--event-log', metavar='DIR',
+                        help="把每条命令写入该目录下的结构化事件日志（按大小和时间切段、后台压缩并建索引）")
+    parser.add_argument('--no-command-log', action='store_true',
+                        help="不再把每条命令和响应写入 logs/server.log（配合 --event-log 使用）")
+    parser.add_argument('--tls-cert', metavar='FILE', help="服务器证书（PEM），指定后只接受 TLS 连接")
+    parser.add_argument('--tls-key', metavar='FILE', help="服务器私钥（PEM），与证书在同一文件中时可省略")
+    parser.add_argument('--tls-ciphers', help="TLS 1.2 使用的密码套件（OpenSSL 格式）")
+    parser.add_argument('--audit', action='store_true',
+                        help="把每笔取款记入 data/audit.log 哈希链审计日志，可用 python -m src.audit verify 核对")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    server = ATMServer()
+    args = parse_args()
+    store = open_store(args.shards, args.lazy, args.cache_size)
+    limits = None
+    if args.max_withdrawal or args.daily_limit:
+        limits = WithdrawalLimits(args.max_withdrawal, args.daily_limit)
+    server = ATMServer(
+        args.host, args.port, store,
+        snapshot_interval=args.snapshot_interval,
+        admin_port=args.admin_port,
+        trace_path=args.trace,
+        limits=limits,
+        events=EventLog(args.event_log) if args.event_log else None,
+        command_log=not args.no_command_log,
+        audit=AuditLog() if args.audit else None,
+        tls_context=server_context(args.tls_cert, args.tls_key, args.tls_ciphers) if args.tls_cert else None
+    )
     server.start()
@@ -0,0 +1,275 @@
+import argparse
+import csv
+import datetime
+import json
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .account_store import open_store
+from .history import HISTORY_DB
+
+# 金额比较的容差
+EPSILON = 1e-6
+
+
+def _connect(path):
+    """只读打开交易记录库；WAL 模式下服务器运行时也可以读取"""
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def _stream(conn, sql, params, chunk_size):
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def partitions(low, high, count):
+    """把序号区间 [low, high] 切成至多 count 段"""
+    if low is None:
+        return []
+    size = max(1, -(-(high - low + 1) // count))
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+
+def aggregate_window(path, start, end, since, until, chunk_size):
+    """
+    汇总一段序号区间内、结算时间窗口中的取款：按卡号和按终端的 (笔数, 金额)
+
+    分组求和在 SQLite 中完成，只把分组结果分块取回。
+    """
+    conn = _connect(path)
+    try:
+        # 冲正（REV）抵消对应的取款：笔数减一，金额为正数
+        where = "seq BETWEEN ? AND ? AND kind IN ('WDRA', 'REV') AND ts >= ? AND ts < ?"
+        params = (start, end, since, until)
+        count = "SUM(CASE kind WHEN 'WDRA' THEN 1 ELSE -1 END)"
+        cards = {
+            card: (count, total) for card, count, total in _stream(
+                conn, f"SELECT card, {count}, -SUM(amount) FROM history WHERE {where} GROUP BY card",
+                params, chunk_size)
+        }
+        terminals = {
+            terminal: (count, total) for terminal, count, total in _stream(
+                conn, f"SELECT terminal, {count}, -SUM(amount) FROM history WHERE {where} GROUP BY terminal",
+                params, chunk_size)
+        }
+        return cards, terminals
+    finally:
+        conn.close()
+
+
+def latest_balances(path, start, end, chunk_size):
+    """一段序号区间内每张卡最后一条记录的 (序号, 余额)"""
+    conn = _connect(path)
+    try:
+        # SQLite 保证与 MAX() 同时选出的其他列取自该最大值所在的行
+        return {
+            card: (seq, balance) for card, seq, balance in _stream(
+                conn, "SELECT card, MAX(seq), balance FROM history WHERE seq BETWEEN ? AND ? GROUP BY card",
+                (start, end), chunk_size)
+        }
+    finally:
+        conn.close()
+
+
+def _merge_totals(target, partial):
+    for key, (count, total) in partial.items():
+        old_count, old_total = target.get(key, (0, 0.0))
+        target[key] = (old_count + count, old_total + total)
+
+
+class Settlement:
+    """一次结算的结果"""
+
+    def __init__(self, since, until):
+        self.since = since
+        self.until = until
+        self.cards = {}
+        self.terminals = {}
+        self.latest = {}
+        self.balance_mismatches = []
+        self.terminal_mismatches = []
+
+    @property
+    def debit_count(self):
+        return sum(count for count, _ in self.terminals.values())
+
+    @property
+    def debit_total(self):
+        return sum(total for _, total in self.terminals.values())
+
+    @property
+    def ok(self):
+        return not self.balance_mismatches and not self.terminal_mismatches
+
+
+def settle(path, since, until, workers=4, partition_count=None, chunk_size=10000):
+    """
+    并行汇总结算窗口内的取款，并取出每张卡的最新余额
+
+    窗口内的记录按 seq 区间切分，每段由一个进程独立读取和分组汇总；
+    最新余额按整个表的 seq 区间切分，合并时取序号最大的记录。
+    """
+    settlement = Settlement(since, until)
+    partition_count = partition_count or workers
+
+    conn = _connect(path)
+    try:
+        window_low, window_high = conn.execute(
+            "SELECT MIN(seq), MAX(seq) FROM history WHERE ts >= ? AND ts < ?", (since, until)
+        ).fetchone()
+        table_low, table_high = conn.execute("SELECT MIN(seq), MAX(seq) FROM history").fetchone()
+    finally:
+        conn.close()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window_jobs = [
+            pool.submit(aggregate_window, path, start, end, since, until, chunk_size)
+            for start, end in partitions(window_low, window_high, partition_count)
+        ]
+        latest_jobs = [
+            pool.submit(latest_balances, path, start, end, chunk_size)
+            for start, end in partitions(table_low, table_high, partition_count)
+        ]
+        for job in window_jobs:
+            cards, terminals = job.result()
+            _merge_totals(settlement.cards, cards)
+            _merge_totals(settlement.terminals, terminals)
+        for job in latest_jobs:
+            for card, (seq, balance) in job.result().items():
+                if card not in settlement.latest or seq > settlement.latest[card][0]:
+                    settlement.latest[card] = (seq, balance)
+
+    return settlement
+
+
+def reconcile_balances(settlement, store):
+    """比较每张卡最后一条交易记录中的余额和存储中的当前余额"""
+    seen = set()
+    for card, user in store.iter_users():
+        seen.add(card)
+        record = settlement.latest.get(card)
+        if record is not None and abs(record[1] - user["balance"]) > EPSILON:
+            settlement.balance_mismatches.append(
+                f"{card}: 存储余额 {user['balance']}，最后一条交易记录余额 {record[1]}（序号 {record[0]}）")
+    for card in sorted(set(settlement.latest) - seen):
+        settlement.balance_mismatches.append(f"{card}: 有交易记录但存储中不存在")
+
+
+def reconcile_terminals(settlement, reports):
+    """
+    比较终端上报的出钞金额与服务器记录的取款金额
+
+    参数:
+        reports: {终端编号: 出钞金额}，终端编号与交易记录中的 terminal 一致（终端在 HELO 中发送的编号）
+    """
+    for terminal in sorted(set(reports) | set(settlement.terminals), key=str):
+        count, debited = settlement.terminals.get(terminal, (0, 0.0))
+        if terminal not in reports:
+            settlement.terminal_mismatches.append(f"终端 {terminal}: 服务器记录取款 {debited}（{count} 笔），未上报出钞")
+        elif abs(reports[terminal] - debited) > EPSILON:
+            settlement.terminal_mismatches.append(
+                f"终端 {terminal}: 上报出钞 {reports[terminal]}，服务器记录取款 {debited}（{count} 笔）")
+
+
+def load_terminal_reports(paths, day):
+    """
+    读取终端上报文件中某一天的出钞金额
+
+    上报文件与终端的 data/cassettes.json 格式相同，使用其中的 terminal 和按日累计的 dispensed[day]。
+    """
+    reports = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if not state.get("terminal"):
+            raise ValueError(f"{path} 中没有终端编号 terminal")
+        amount = state.get("dispensed", {}).get(day, 0.0)
+        reports[state["terminal"]] = reports.get(state["terminal"], 0.0) + amount
+    return reports
+
+
+def parse_time(text):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"无法解析的时间: {text}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="日终结算：汇总交易记录，与账户余额和终端出钞核对")
+    parser.add_argument('--history', default=HISTORY_DB, help="交易记录数据库")
+    parser.add_argument('--date', help="结算日期 YYYY-MM-DD（默认今天），与 --since/--until 二选一")
+    parser.add_argument('--since', type=parse_time, help="结算窗口开始时间")
+    parser.add_argument('--until', type=parse_time, help="结算窗口结束时间（不含）")
+    parser.add_argument('--terminal-report', action='extend', nargs='+', default=[], metavar='FILE',
+                        help="终端上报文件（cassettes.json 格式），可指定多个；终端按日上报，只能与 --date 一起使用")
+    parser.add_argument('--shards', type=int, default=0, help="使用分片存储（与服务器的 --shards 一致）")
+    parser.add_argument('--lazy', action='store_true', help="使用按需加载模式的 SQLite 存储（与服务器的 --lazy 一致）")
+    parser.add_argument('--workers', type=int, default=4, help="并行读取交易记录的进程数")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="每次从数据库取回的行数")
+    parser.add_argument('--cards-csv', metavar='FILE', help="把按卡号汇总的结果写入CSV文件")
+    parser.add_argument('--max-report', type=int, default=20, help="最多列出的不一致项数")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.since is not None or args.until is not None:
+        if args.since is None or args.until is None:
+            sys.exit("--since 和 --until 需要同时指定")
+        if args.terminal_report:
+            sys.exit("终端出钞按日上报，核对终端时请使用 --date 指定结算日期")
+        since, until = args.since, args.until
+    else:
+        day = datetime.datetime.strptime(args.date, '%Y-%m-%d') if args.date else \
+            datetime.datetime.combine(datetime.date.today(), datetime.time())
+        since, until = day.timestamp(), (day + datetime.timedelta(days=1)).timestamp()
+
+    started = time.perf_counter()
+    settlement = settle(args.history, since, until, args.workers, chunk_size=args.chunk_size)
+    aggregated = time.perf_counter()
+
+    store = open_store(args.shards, args.lazy)
+    try:
+        reconcile_balances(settlement, store)
+    finally:
+        store.close()
+    if args.terminal_report:
+        day = datetime.date.fromtimestamp(since).isoformat()
+        reconcile_terminals(settlement, load_terminal_reports(args.terminal_report, day))
+
+    window = f"{datetime.datetime.fromtimestamp(since):%Y-%m-%d %H:%M:%S} ~ {datetime.datetime.fromtimestamp(until):%Y-%m-%d %H:%M:%S}"
+    print(f"结算窗口: {window}")
+    print(f"取款: {settlement.debit_count} 笔，合计 {settlement.debit_total:.2f}  卡数: {len(settlement.cards)}  "
+          f"汇总用时: {aggregated - started:.2f} 秒  核对用时: {time.perf_counter() - aggregated:.2f} 秒")
+    print(f"{'终端':<20}{'笔数':>10}{'金额':>16}")
+    for terminal, (count, total) in sorted(settlement.terminals.items(), key=lambda item: str(item[0])):
+        print(f"{str(terminal):<20}{count:>10}{total:>16.2f}")
+
+    if args.cards_csv:
+        with open(args.cards_csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["card", "count", "total"])
+            for card, (count, total) in sorted(settlement.cards.items()):
+                writer.writerow([card, count, total])
+
+    problems = settlement.balance_mismatches + settlement.terminal_mismatches
+    for problem in problems[:args.max_report]:
+        print(problem)
+    if settlement.ok:
+        print("结算完成，余额和终端出钞均一致")
+    else:
+        print(f"发现不一致: 余额 {len(settlement.balance_mismatches)} 处，终端 {len(settlement.terminal_mismatches)} 处")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import logging
+import ssl
+import threading
+
+logger = logging.getLogger('TLS')
+
+
+def server_context(certfile, keyfile=None, ciphers=None):
+    """
+    创建服务器端 TLS 上下文
+
+    参数:
+        ciphers: OpenSSL 格式的密码套件列表（只影响 TLS 1.2，TLS 1.3 的套件由 OpenSSL 决定）
+    TLS 1.3 下服务器在握手后发放会话票据，客户端下次连接时凭票据恢复会话，省去证书交换和签名验证。
+    """
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    if ciphers:
+        context.set_ciphers(ciphers)
+    return context
+
+
+def client_context(cafile=None, ciphers=None, verify=True):
+    """
+    创建客户端 TLS 上下文
+
+    参数:
+        cafile: 信任的CA证书（自签名证书时为服务器证书本身），None 时使用系统证书
+        verify: 是否校验服务器证书，仅用于测试
+    """
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=cafile)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if ciphers:
+        context.set_ciphers(ciphers)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class TLSSessionCache:
+    """
+    客户端 TLS 会话缓存
+
+    保存最近一次连接得到的会话，新连接用它恢复会话；多个客户端共享同一个缓存时
+    （例如命令行终端的多个并发会话），只有第一次连接需要完整握手。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.resumed = 0
+        self.full = 0
+
+    def get(self):
+        with self.lock:
+            return self.session
+
+    def connected(self, tls_socket):
+        """握手完成后记录本次是否恢复了会话"""
+        with self.lock:
+            if tls_socket.session_reused:
+                self.resumed += 1
+            else:
+                self.full += 1
+
+    def put(self, tls_socket):
+        """
+        保存连接的会话供下次使用
+
+        TLS 1.3 的会话票据在握手之后才到达，应在连接上收到过数据之后（例如关闭前）调用。
+        """
+        session = tls_socket.session
+        if session is not None and (session.has_ticket or session.id):
+            with self.lock:
+                self.session = session